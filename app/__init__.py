@@ -6,6 +6,19 @@ from app.extensions import socketio
 
 from app.config import DevelopmentConfig, ProductionConfig, TestingConfig
 from app.models import db
+from app.services.course_index import course_index
+from app.services.embedding import embedding_service
+from app.services.embedding_cache import embedding_cache
+from app.services.feedback import feedback_generator
+from app.services.index_cache import index_cache
+from app.services.ingestion import ingestion
+from app.services.llm_gateway import llm_gateway
+from app.services.llm_scheduler import llm_scheduler
+from app.services.loader import preload
+from app.services.pdf_pages import page_extractor
+from app.services.semantic_cache import semantic_cache
+from app.services.storage_report import storage_reports
+from app.services.vector_index import index_factory
 
 app = Flask(__name__)
 
@@ -22,6 +35,18 @@ def create_app(environment="development"):
     migrate = Migrate(app, db)
     jwt = JWTManager(app)
     socketio.init_app(app)
+    index_cache.init_app(app)
+    embedding_service.init_app(app)
+    embedding_cache.init_app(app)
+    ingestion.init_app(app)
+    feedback_generator.init_app(app)
+    semantic_cache.init_app(app)
+    llm_gateway.init_app(app)
+    llm_scheduler.init_app(app)
+    index_factory.init_app(app)
+    course_index.init_app(app)
+    page_extractor.init_app(app)
+    storage_reports.init_app(app)
 
     with app.app_context():
         from app.routes import ai_chat, auth, course, file, group_chat, user, student
@@ -33,4 +58,12 @@ def create_app(environment="development"):
         app.register_blueprint(file.bp)
         app.register_blueprint(group_chat.bp)
         app.register_blueprint(student.bp)
+
+        # 接回上次行程遺留的背景工作
+        if ingestion.recover_on_start:
+            ingestion.recover()
+
+        # AI 服務預設在第一次使用時才載入，專門的 AI worker 可設定 AI_PRELOAD 預先載入
+        if app.config["AI_PRELOAD"]:
+            preload()
         return app
@@ -44,6 +44,85 @@ class Config:
 
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+    # FAISS 索引快取的記憶體上限 (bytes)
+    INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+
+    # 是否在 create_app 時就載入 AI 模型（預設在第一次使用時才載入）
+    AI_PRELOAD = os.environ.get("AI_PRELOAD", "false").lower() == "true"
+
+    # 共用的嵌入模型與批次設定
+    EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "paraphrase-multilingual-MiniLM-L12-v2")
+    EMBEDDING_MAX_BATCH_SIZE = int(os.environ.get("EMBEDDING_MAX_BATCH_SIZE", 64))
+    EMBEDDING_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_MAX_WAIT_MS", 5))
+    # 嵌入推論後端：torch / onnx / onnx-int8（int8 動態量化，指令集可選 avx2 / avx512 / avx512_vnni / arm64）
+    # onnx 後端需要另外安裝 optimum[onnxruntime]
+    EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+    EMBEDDING_QUANTIZATION = os.environ.get("EMBEDDING_QUANTIZATION", "avx2")
+
+    # 學生提問時從教師問答中檢索的筆數
+    STUDENT_KNOWLEDGE_TOP_K = int(os.environ.get("STUDENT_KNOWLEDGE_TOP_K", 5))
+
+    # 學生問題的語意快取：相似度門檻、存活秒數與每個單元的最大筆數
+    SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))
+    SEMANTIC_CACHE_TTL = int(os.environ.get("SEMANTIC_CACHE_TTL", 3600))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 256))
+
+    # 對話記憶：保留原文的 token 預算，超出時縮減到 budget * keep_ratio 並併入摘要
+    MEMORY_TOKEN_BUDGET = int(os.environ.get("MEMORY_TOKEN_BUDGET", 3000))
+    MEMORY_KEEP_RATIO = float(os.environ.get("MEMORY_KEEP_RATIO", 0.5))
+
+    # 產生學生回饋時同時呼叫 LLM 的數量與使用的模型
+    FEEDBACK_CONCURRENCY = int(os.environ.get("FEEDBACK_CONCURRENCY", 4))
+    FEEDBACK_MODEL = os.environ.get("FEEDBACK_MODEL", "gpt-4")
+
+    # 上傳後背景建立索引的 worker 數量與逾時秒數
+    INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", 1))
+    INGESTION_JOB_TIMEOUT = int(os.environ.get("INGESTION_JOB_TIMEOUT", 1800))
+    # 啟動時重新提交上次行程遺留的 pending 工作，並重排執行逾時的工作
+    INGESTION_RECOVER_ON_START = (
+        os.environ.get("INGESTION_RECOVER_ON_START", "true").lower() == "true"
+    )
+
+    # PDF 逐頁提取的行程數與每個工作的頁數；段落的 token 上限與重疊，以及建立索引時的嵌入批次大小
+    PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", min(os.cpu_count() or 1, 4)))
+    PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", 8))
+    CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", 120))
+    CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", 20))
+    INGESTION_EMBED_BATCH_SIZE = int(os.environ.get("INGESTION_EMBED_BATCH_SIZE", 128))
+
+    # 嵌入向量快取（SQLite，float16），以模型名稱與段落 sha256 為鍵
+    EMBEDDING_CACHE_ENABLED = os.environ.get("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+    EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")
+    # 快取上限：超過筆數或超過天數沒有使用的向量由最久未使用的開始刪除，0 表示不限制
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+    EMBEDDING_CACHE_MAX_AGE_DAYS = int(os.environ.get("EMBEDDING_CACHE_MAX_AGE_DAYS", 90))
+
+    # 向量索引類型：auto 依向量數量自動選擇，或指定 flat / ivf_flat / hnsw / ivf_pq
+    VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "auto")
+    VECTOR_INDEX_NPROBE = int(os.environ.get("VECTOR_INDEX_NPROBE", 16))
+    VECTOR_INDEX_EF_SEARCH = int(os.environ.get("VECTOR_INDEX_EF_SEARCH", 64))
+    # 向量儲存方式：float32 / fp16 / sq8 / pq（課程可個別覆寫）；壓縮索引先取 top_k × 倍數個候選再以原始向量重新排序
+    VECTOR_INDEX_STORAGE = os.environ.get("VECTOR_INDEX_STORAGE", "float32")
+    VECTOR_INDEX_RERANK_FACTOR = int(os.environ.get("VECTOR_INDEX_RERANK_FACTOR", 4))
+    # 儲存方式比較報告最多抽樣的向量數（以整個檔案為單位）
+    STORAGE_REPORT_MAX_VECTORS = int(os.environ.get("STORAGE_REPORT_MAX_VECTORS", 20000))
+
+    # LLM gateway：單次呼叫逾時秒數、429/5xx 重試次數、連線池大小與斷路器門檻/冷卻秒數
+    LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 60))
+    LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 3))
+    LLM_POOL_SIZE = int(os.environ.get("LLM_POOL_SIZE", 50))
+    LLM_BREAKER_THRESHOLD = int(os.environ.get("LLM_BREAKER_THRESHOLD", 5))
+    LLM_BREAKER_RESET = float(os.environ.get("LLM_BREAKER_RESET", 30))
+
+    # LLM 排程：整體、批次工作、每門課與每位教師的同時呼叫上限，以及供應商每分鐘額度（0 為不限制）
+    LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 16))
+    LLM_BATCH_MAX_CONCURRENCY = int(os.environ.get("LLM_BATCH_MAX_CONCURRENCY", 8))
+    LLM_COURSE_MAX_CONCURRENCY = int(os.environ.get("LLM_COURSE_MAX_CONCURRENCY", 8))
+    LLM_TEACHER_MAX_CONCURRENCY = int(os.environ.get("LLM_TEACHER_MAX_CONCURRENCY", 8))
+    LLM_REQUESTS_PER_MINUTE = int(os.environ.get("LLM_REQUESTS_PER_MINUTE", 0))
+    LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", 0))
+
 class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_ECHO = True
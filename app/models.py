@@ -1,3 +1,4 @@
+import json
 import uuid
 from datetime import datetime
 
@@ -60,6 +61,8 @@ class Course(db.Model):
     semester = db.Column(db.String(20), nullable=False)
     archive = db.Column(db.Boolean, default=False, nullable=False)
     is_favorite = db.Column(db.Boolean, default=False)
+    # 向量索引的儲存方式 (float32 / fp16 / sq8 / pq)，空值表示使用 VECTOR_INDEX_STORAGE
+    vector_storage = db.Column(db.String(20), nullable=True)
 
     conversations = db.relationship(
         "TeacherAIConversations", backref="course", lazy=True
@@ -78,6 +81,7 @@ class Course(db.Model):
             "semester": self.semester,
             "archive": self.archive,
             "is_favorite": self.is_favorite,
+            "vector_storage": self.vector_storage,
         }
 
     def get_sections(self):
@@ -127,6 +131,9 @@ class TeacherAIConversations(db.Model):
     teacher_id = db.Column(db.Integer, db.ForeignKey("teachers.id"), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.now)
     summary = db.Column(db.Text, nullable=True)
+    # 較舊回合的滾動摘要，summarized_until 為已併入摘要的最後一則訊息 id
+    history_summary = db.Column(db.Text, nullable=True)
+    summarized_until = db.Column(db.Integer, nullable=True)
 
 
 class TeacherAIMessages(db.Model):
@@ -156,6 +163,25 @@ class StudentAIConversations(db.Model):
     # student = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
     # created_at = db.Column(db.DateTime, default=datetime.now())
     # summary = db.Column(db.Text, nullable=True)
+    # 舊版以 JSON 保存的教師問答快照，第一次讀取時搬到 SectionKnowledgePairs
+    knowledge = db.deferred(db.Column(db.Text, nullable=True))
+    # 教師問答快照的版本，部署或新增問答時遞增；快照內容在 SectionKnowledgePairs
+    knowledge_version = db.Column(db.Integer, default=0, server_default="0", nullable=False)
+    deployed_at = db.Column(db.DateTime, nullable=True)
+
+
+# 已部署單元的教師問答快照，一組問答一筆；教師新增問答時逐筆加入
+class SectionKnowledgePairs(db.Model):
+    __tablename__ = "section_knowledge_pairs"
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey("student_ai_conversations.id"), nullable=False, index=True
+    )
+    question = db.Column(db.Text, nullable=False)
+    answer = db.Column(db.Text, nullable=False)
+
+    def to_pair(self):
+        return {"q": self.question, "a": self.answer}
 
 
 class StudentAIMessages(db.Model):
@@ -174,9 +200,95 @@ class StudentAIMessages(db.Model):
     )
 
 
+# 學生在某個單元對話的滾動摘要（StudentAIConversations 由整個單元共用）
+class StudentAIMemories(db.Model):
+    __tablename__ = "student_ai_memories"
+    # 每個學生在每個對話只有一筆記憶
+    __table_args__ = (db.UniqueConstraint("conversation_id", "student_id"),)
+    id = db.Column(db.Integer, primary_key=True)
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey("student_ai_conversations.id"), nullable=False
+    )
+    student_id = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
+    summary = db.Column(db.Text, nullable=True)
+    summarized_until = db.Column(db.Integer, nullable=True)
+
+
 class TeacherAIFaisses(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     file_id = db.Column(db.Integer, db.ForeignKey("teacher_files.id"), nullable=False)
+    # 共用的索引檔名稱（內容 checksum + 嵌入模型），舊資料為空，索引以 file_id 命名
+    artifact = db.Column(db.String(128), nullable=True, index=True)
+
+    @property
+    def index_name(self):
+        return self.artifact or str(self.file_id)
+
+
+# 上傳後的背景索引工作
+class IngestionJobs(db.Model):
+    __tablename__ = "ingestion_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    file_id = db.Column(db.Integer, db.ForeignKey("teacher_files.id"), nullable=False)
+    # 工作排入佇列時預期的索引檔名稱，設定不變時失敗的工作不會被 backfill 重跑
+    artifact = db.Column(db.String(128), nullable=True)
+    # pending / running / done / failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # 嵌入快取的命中數、實際嵌入秒數與估計省下的秒數
+    cache_hits = db.Column(db.Integer, nullable=True)
+    cache_misses = db.Column(db.Integer, nullable=True)
+    encode_seconds = db.Column(db.Float, nullable=True)
+    encode_seconds_saved = db.Column(db.Float, nullable=True)
+
+    def to_dict(self):
+        total = (self.cache_hits or 0) + (self.cache_misses or 0)
+        return {
+            "id": self.id,
+            "file_id": self.file_id,
+            "status": self.status,
+            "error": self.error,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "embedding_cache": {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_ratio": self.cache_hits / total if total else None,
+                "encode_seconds": self.encode_seconds,
+                "encode_seconds_saved": self.encode_seconds_saved,
+            },
+        }
+
+
+# 課程向量儲存方式的比較報告（背景工作）
+class VectorStorageReports(db.Model):
+    __tablename__ = "vector_storage_reports"
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey("courses.id"), nullable=False)
+    top_k = db.Column(db.Integer, nullable=False, default=10)
+    # pending / running / done / failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    error = db.Column(db.Text, nullable=True)
+    # JSON：各儲存方式的索引大小、recall 與查詢時間
+    report = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "course_id": self.course_id,
+            "top_k": self.top_k,
+            "status": self.status,
+            "error": self.error,
+            "report": json.loads(self.report) if self.report else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
 
 
 # Upload files: Teachers
@@ -229,3 +341,54 @@ class StudentAIFeedbacks(db.Model):
         db.Integer, db.ForeignKey("student_ai_conversations.id"), nullable=False
     )
     feedback = db.Column(db.String(600), nullable=False)
+    # 這份回饋涵蓋到的最後一則學生對話訊息 id
+    last_message_id = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.now, onupdate=datetime.now)
+
+
+# 產生學生回饋的背景工作
+class FeedbackJobs(db.Model):
+    __tablename__ = "feedback_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+    course_id = db.Column(db.Integer, db.ForeignKey("courses.id"), nullable=False)
+    course_section = db.Column(db.Integer, nullable=False)
+    teacher_id = db.Column(db.Integer, db.ForeignKey("teachers.id"), nullable=False)
+    conversation_id = db.Column(
+        db.Integer, db.ForeignKey("student_ai_conversations.id"), nullable=False
+    )
+    # pending / running / done / failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    total = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        counts = dict(
+            db.session.query(FeedbackJobStudents.status, db.func.count())
+            .filter_by(job_id=self.id)
+            .group_by(FeedbackJobStudents.status)
+            .all()
+        )
+        return {
+            "id": self.id,
+            "course_id": self.course_id,
+            "course_section": self.course_section,
+            "status": self.status,
+            "total": self.total,
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "pending": counts.get("pending", 0),
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+# 回饋工作中每位學生的進度
+class FeedbackJobStudents(db.Model):
+    __tablename__ = "feedback_job_students"
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.Integer, db.ForeignKey("feedback_jobs.id"), nullable=False)
+    student_id = db.Column(db.Integer, db.ForeignKey("students.id"), nullable=False)
+    # pending / done / failed
+    status = db.Column(db.String(20), nullable=False, default="pending")
+    error = db.Column(db.Text, nullable=True)
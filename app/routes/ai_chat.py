@@ -1,4 +1,4 @@
-from flask import Blueprint, jsonify, request, current_app
+from flask import Blueprint, Response, jsonify, request, current_app, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt
 from app.models import (
     Teacher,
@@ -11,21 +11,35 @@ from app.models import (
     Course,
     CourseSections,
     StudentAIFeedbacks,
+    FeedbackJobs,
     db,
 )
-from app.services.ai_teacher import AITeacher
-from app.services.ai_student import AIStudent
+from app.services.background import BackgroundExecutor
+from app.services.course_index import course_index
+from app.services.feedback import feedback_generator
+from app.services.ingestion import ingestion
+from app.services.llm_scheduler import BATCH, INTERACTIVE, CallScope
+from app.services.loader import get_ai_student, get_ai_teacher
+from app.services.memory import ConversationMemory
+from app.services import prompts
+from app.services.metrics import metrics
+from app.services.section_knowledge import section_knowledge
+from app.services.semantic_cache import semantic_cache
 from datetime import datetime
+import functools
+import json
+import time
 import uuid
-from langchain_openai import ChatOpenAI
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
 
 
 
 bp = Blueprint("chat", __name__)
 
-aiteacher = AITeacher(current_app.config["OPENAI_API_KEY"])
-aistudent = AIStudent(current_app.config["OPENAI_API_KEY"])
+# 對話標題摘要在回應送出後於背景產生
+summary_executor = BackgroundExecutor("conversation-summary", max_workers=2)
+
+SUMMARY_PENDING = "Summary is being generated"
+SUMMARY_FAILED = "無法生成摘要。"
 
 
 @bp.route("/start_conversation", methods=["GET"])
@@ -64,6 +78,64 @@ def is_valid_uuid(uuid_to_test):
         return False
 
 
+def build_memory(service, scope):
+    return ConversationMemory(
+        current_app.config["MEMORY_TOKEN_BUDGET"],
+        functools.partial(service.invoke, scope=scope),
+        keep_ratio=current_app.config["MEMORY_KEEP_RATIO"],
+    )
+
+
+def summarize_conversation(conversation_id, text, scope):
+    conversation = TeacherAIConversations.query.get(conversation_id)
+    if conversation is None or conversation.summary:
+        return
+    # 結束讀取的交易，不在等待 LLM 期間持有
+    db.session.commit()
+
+    summary = SUMMARY_FAILED
+    try:
+        summary = get_ai_teacher().summarize_text(text, scope)
+    finally:
+        # 失敗時也寫入，否則對話列表會一直顯示 SUMMARY_PENDING；
+        # 以條件式 UPDATE 寫入，產生摘要期間對話被刪除或已有摘要時不會更新，也不會因物件過期而出錯
+        TeacherAIConversations.query.filter_by(id=conversation_id, summary=None).update(
+            {"summary": summary}, synchronize_session=False
+        )
+        db.session.commit()
+
+
+def _sse(data, event=None):
+    payload = json.dumps(data, ensure_ascii=False)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+def stream_answer(name, chunks, on_complete, extra=None):
+    """以 SSE 逐段送出回應，完成後呼叫 on_complete(answer) 保存完整內容；extra 會附在 done 事件中"""
+
+    def generate():
+        start = time.perf_counter()
+        parts = []
+        for chunk in chunks:
+            if not parts:
+                metrics.observe(f"{name}.ttft_seconds", time.perf_counter() - start)
+            parts.append(chunk)
+            yield _sse({"token": chunk})
+
+        answer = "".join(parts).strip()
+        metrics.observe(f"{name}.stream_seconds", time.perf_counter() - start)
+        on_complete(answer)
+        yield _sse({"answer": answer, **(extra or {})}, event="done")
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @bp.route("/chat/<string:conversation_uuid>", methods=["POST"])
 @jwt_required()
 def chat(conversation_uuid):
@@ -106,6 +178,7 @@ def chat(conversation_uuid):
             )
             db.session.add(new_conversation)
             db.session.commit()
+            conversation = new_conversation
         else:
             return jsonify({"message": "The UUID of conversation is invalid."}), 400
 
@@ -120,78 +193,159 @@ def chat(conversation_uuid):
             {"message": "The UUID of conversation and the user input are required."}
         ), 400
 
+    aiteacher = get_ai_teacher()
+    sources = []
+
     if "file_id" in data:
         file = TeacherFiles.query.filter_by(id=data["file_id"]).first()
 
         if file is None:
             return jsonify({"message": "file_id is invalid."}), 400
 
-        file_content = aiteacher.extract_text_from_pdf(file.path)
-
-        if not file_content:
-            return jsonify({"message": "Unable to read file."}), 400
-
         faiss_file = TeacherAIFaisses.query.filter_by(file_id=data["file_id"]).first()
 
+        if faiss_file is not None and not ingestion.is_current(faiss_file, file):
+            # 嵌入模型或切段設定變更後，舊的向量不能與新的查詢向量比較
+            job = ingestion.ensure_job(file.id, rebuild=True)
+            return jsonify(
+                {
+                    "message": "The file is being re-indexed.",
+                    "job": job.to_dict(),
+                }
+            ), 202
+
         if faiss_file is not None:
-            index, sentences = aiteacher.load_faiss_index(data["file_id"])
-            print(sentences)
-            if index is None or sentences is None:
-                faiss_index = TeacherAIFaisses.query.get(faiss_file.id)
-                db.session.delete(faiss_index)
-                db.session.commit()
-                return jsonify({"message": "Unable to read faiss file"}), 400
-        else:
-            index, sentences = aiteacher.build_faiss_index(
-                file_content, data["file_id"]
+            index, sentences = aiteacher.load_faiss_index(
+                faiss_file.index_name, file.checksum
             )
-
             if index is None or sentences is None:
-                print("建立索引失敗，程式結束。")
-                return
-
-            faiss_index = TeacherAIFaisses(file_id=data["file_id"])
-            db.session.add(faiss_index)
-            db.session.commit()
+                jobs = ingestion.discard(faiss_file)
+                if not jobs:
+                    return jsonify(
+                        {"message": "Unable to read faiss file, please try again later."}
+                    ), 503
+                job = next(job for job in jobs if job.file_id == file.id)
+                return jsonify(
+                    {"message": "Unable to read faiss file", "job": job.to_dict()}
+                ), 400
+        else:
+            # 索引由背景工作建立，聊天請求不會自己建立索引
+            job = ingestion.ensure_job(file.id)
+            return jsonify(
+                {
+                    "message": "The file is still being indexed.",
+                    "job": job.to_dict(),
+                }
+            ), 202
 
-        aiteacher.system_context = """您是一位AI教學助手。
-請基於上述內容來回答問題。如果需要引入新的例子或故事，請確保與原始課程內容保持關聯。"""
+        system_prompt = prompts.TEACHER_RAG_SYSTEM_PROMPT
 
         relevant_context = aiteacher.search_rag(user_input, index, sentences)
 
         context = "\n".join(relevant_context)
 
+    elif data.get("course_search"):
+        # 一次搜尋整門課的所有檔案；尚未加入課程索引的檔案由上傳或 backfill 處理
+        hits = course_index.search(conversation.course_id, user_input)
+        pending_jobs = [] if hits else ingestion.pending_jobs(conversation.course_id)
+        if not hits and pending_jobs:
+            return jsonify(
+                {
+                    "message": "The course files are still being indexed.",
+                    "jobs": [job.to_dict() for job in pending_jobs],
+                }
+            ), 202
+
+        file_names = {
+            file.id: file.name
+            for file in TeacherFiles.query.filter(
+                TeacherFiles.id.in_({hit["file_id"] for hit in hits})
+            )
+        }
+        for hit in hits:
+            sources.append(
+                {
+                    "file_id": hit["file_id"],
+                    "file_name": file_names.get(hit["file_id"]),
+                    "page": hit["page"],
+                    "score": hit["score"],
+                }
+            )
+
+        system_prompt = prompts.TEACHER_RAG_SYSTEM_PROMPT
+        context = "\n".join(
+            f"[{file_names.get(hit['file_id'], hit['file_id'])} 第 {hit['page']} 頁] {hit['text']}"
+            for hit in hits
+        )
+
     else:
-        aiteacher.system_context = ""
+        system_prompt = ""
         context = ""
 
     conversation, conversation_history = aiteacher.load_conversation_history(
-        conversation_uuid
+        conversation_uuid, since_summary=True
     )
     if not conversation:
         return jsonify({"message": "The UUID of conversation is invalid."}), 400
 
-    if len(conversation_history) == 0:
-        conversation.summary = aiteacher.summarize_text(user_input)
-        db.session.commit()
+    scope = CallScope(
+        priority=INTERACTIVE, course_id=conversation.course_id, teacher_id=user_id
+    )
 
-    messages = [
-        SystemMessage(content=aiteacher.system_context),
-        SystemMessage(content=f"相關上下文：\n\n{context}"),
-    ]
+    if (
+        len(conversation_history) == 0
+        and not conversation.summarized_until
+        and not conversation.summary
+    ):
+        summary_executor.submit(
+            current_app._get_current_object(),
+            summarize_conversation,
+            conversation.id,
+            user_input,
+            CallScope(BATCH, conversation.course_id, user_id),
+        )
 
-    for _, q, a, _ in conversation_history:
-        messages.append(HumanMessage(content=q))
-        messages.append(AIMessage(content=a))
+    memory = build_memory(aiteacher, scope)
+    history_summary, summarized_until, recent_turns = memory.build(
+        conversation.history_summary, conversation.summarized_until, conversation_history
+    )
+    if summarized_until != conversation.summarized_until:
+        conversation.history_summary = history_summary
+        conversation.summarized_until = summarized_until
+        db.session.commit()
 
-    messages.append(HumanMessage(user_input))
+    messages = prompts.build_teacher_messages(
+        prompts.ChatPrompt(
+            system=system_prompt,
+            user_input=user_input,
+            context=context,
+            summary=history_summary or "",
+            history=tuple((q, a) for _, q, a in recent_turns),
+        )
+    )
+
+    def save_answer(answer):
+        aiteacher.save_message(conversation.id, "user", user_input)
+        aiteacher.save_message(conversation.id, "assistant", answer)
+        # 已部署的單元同步加入這組問答，學生端可立即檢索到；LLM 失敗時的錯誤訊息不加入
+        if answer and aiteacher.FALLBACK_ANSWER not in answer:
+            section_knowledge.add_exchange(
+                conversation.course_id, conversation.course_section, user_input, answer
+            )
 
-    answer = aiteacher.generate_response(messages)
-    conversation_history.append((user_input, answer))
+    if data.get("stream"):
+        return stream_answer(
+            "chat",
+            aiteacher.generate_response_stream(messages, scope),
+            save_answer,
+            {"sources": sources} if sources else None,
+        )
 
-    aiteacher.save_message(conversation.id, "user", user_input)
-    aiteacher.save_message(conversation.id, "assistant", answer)
+    answer = aiteacher.generate_response(messages, scope)
+    save_answer(answer)
 
+    if sources:
+        return jsonify({"answer": answer, "sources": sources})
     return jsonify({"answer": answer})
 
 
@@ -232,42 +386,91 @@ def student_chat(course_id, course_section):
     if not user_input:
         return jsonify({"message": "user input are required."}), 400
 
-    aistudent.system_context = "您是一位AI教學助手，以下是先前教師和AI助手的對話紀錄，你需要根據這些對話紀錄，回應學生，記住，不要提到「以前的對話紀錄」，改為「根據老師」。現在開始我是學生。"
+    aistudent = get_ai_student()
 
+    student_memory = aistudent.get_memory(conversation.id, user.id)
     conversation, conversation_history = aistudent.load_conversation_history(
         course_id,
         course_section,
         user.id,
+        after_id=student_memory.summarized_until,
     )
 
     if not conversation:
         return jsonify({"message": "This course is not deployed."}), 400
 
-    messages = [
-        SystemMessage(content=aistudent.system_context),
-        # SystemMessage(content=f"相關上下文：\n\n{context}"),
-    ]
-    teacher_conversation_history = aistudent.load_teacher_conversation_history(
-        course_id
+    question_embedding = semantic_cache.embed(user_input)
+    teacher_knowledge = section_knowledge.search(
+        conversation,
+        user_input,
+        current_app.config["STUDENT_KNOWLEDGE_TOP_K"],
+        query_embedding=question_embedding,
     )
+    # search 可能重新部署而遞增版本，之後才讀取
+    knowledge_version = conversation.knowledge_version
+
+    # 快取只以問題向量比對，學生已有對話紀錄或摘要時答案可能依賴上下文（例如「請再舉一個例子」），不查也不存
+    cache_key = (course_id, course_section)
+    cacheable = not conversation_history and not student_memory.summary
+    cached_answer = None
+    if cacheable:
+        cached_answer = semantic_cache.lookup(cache_key, knowledge_version, question_embedding)
+    if cached_answer is not None:
+
+        def save_cached_answer(answer):
+            aistudent.save_message(conversation.id, user.id, "user", user_input)
+            aistudent.save_message(conversation.id, user.id, "assistant", answer)
+
+        if data.get("stream"):
+            return stream_answer("student_chat", iter([cached_answer]), save_cached_answer)
+
+        save_cached_answer(cached_answer)
+        return jsonify({"answer": cached_answer, "cached": True})
+
+    scope = CallScope(priority=INTERACTIVE, course_id=course_id)
+    memory = build_memory(aistudent, scope)
+    history_summary, summarized_until, recent_turns = memory.build(
+        student_memory.summary, student_memory.summarized_until, conversation_history
+    )
+    if summarized_until != student_memory.summarized_until:
+        student_memory.summary = history_summary
+        student_memory.summarized_until = summarized_until
+        db.session.commit()
 
-    for _, q, a, _ in teacher_conversation_history:
-        messages.append(HumanMessage(content=q))
-        messages.append(AIMessage(content=a))
-
-    messages.append(HumanMessage("以上是教師的對話紀錄"))
-
-    for _, q, a, _ in conversation_history:
-        messages.append(HumanMessage(content=q))
-        messages.append(AIMessage(content=a))
+    messages = prompts.build_student_messages(
+        prompts.ChatPrompt(
+            system=prompts.STUDENT_SYSTEM_PROMPT,
+            user_input=user_input,
+            summary=history_summary or "",
+            history=tuple((q, a) for _, q, a in recent_turns),
+            knowledge=tuple((pair["q"], pair["a"]) for pair in teacher_knowledge),
+        )
+    )
 
-    messages.append(HumanMessage(user_input))
+    started = time.perf_counter()
+
+    def save_answer(answer):
+        aistudent.save_message(conversation.id, user.id, "user", user_input)
+        aistudent.save_message(conversation.id, user.id, "assistant", answer)
+        if cacheable and answer and aistudent.FALLBACK_ANSWER not in answer:
+            semantic_cache.store(
+                cache_key,
+                knowledge_version,
+                user_input,
+                question_embedding,
+                answer,
+                time.perf_counter() - started,
+            )
 
-    answer = aistudent.generate_response(messages)
-    conversation_history.append((user_input, answer))
+    if data.get("stream"):
+        return stream_answer(
+            "student_chat",
+            aistudent.generate_response_stream(messages, scope),
+            save_answer,
+        )
 
-    aistudent.save_message(conversation.id, user.id, "user", user_input)
-    aistudent.save_message(conversation.id, user.id, "assistant", answer)
+    answer = aistudent.generate_response(messages, scope)
+    save_answer(answer)
 
     return jsonify({"answer": answer})
 
@@ -302,7 +505,7 @@ def get_history(conversation_uuid):
     if conversation.teacher_id != user_id:
         return jsonify({"message": "Not authorized."}), 401
 
-    conversation, conversation_history = aiteacher.load_conversation_history(
+    conversation, conversation_history = get_ai_teacher().load_conversation_history(
         conversation_uuid
     )
 
@@ -383,6 +586,15 @@ def list_conversations():
             return jsonify({"message": "User not found."}), 404
 
     conversations = TeacherAIConversations.query.filter_by(teacher_id=user_id).all()
+    # 已有訊息但還沒有摘要的對話，代表摘要仍在背景產生中
+    with_messages = {
+        conversation_id
+        for (conversation_id,) in db.session.query(TeacherAIMessages.conversation_id)
+        .filter(
+            TeacherAIMessages.conversation_id.in_([c.id for c in conversations])
+        )
+        .distinct()
+    }
     conversation_list = []
     for conversation in conversations:
         # course = Course.query.filter_by(id=conversation.course_id).first()
@@ -396,7 +608,11 @@ def list_conversations():
                 "course_section_id": conversation.course_section,
                 "summary": conversation.summary
                 if conversation.summary
+                else SUMMARY_PENDING
+                if conversation.id in with_messages
                 else "No summary available",
+                "summary_pending": not conversation.summary
+                and conversation.id in with_messages,
                 "created_at": conversation.created_at.strftime("%Y-%m-%d %H:%M:%S"),
             }
         )
@@ -466,6 +682,7 @@ def deploy(conversation_uuid):
             )
             db.session.add(new_conversation)
             db.session.commit()
+            conversation = new_conversation
         else:
             return jsonify({"message": "The UUID of conversation is invalid."}), 400
 
@@ -487,13 +704,24 @@ def deploy(conversation_uuid):
             )
             db.session.add(new_student_conversation)
             db.session.commit()
+            # 編譯教師問答快照，學生對話時直接讀取
+            section_knowledge.deploy(new_student_conversation)
+            semantic_cache.invalidate((course_id, course_section))
             return jsonify({"message": "Deploy successfully"}), 200
 
         except Exception as e:
             db.session.rollback()
             return jsonify({"message": "Deploy failed"}), 400
     else:
-        return jsonify({"message": "The llm of this section has already been deployed."}), 500
+        # 已部署的單元重新編譯快照
+        try:
+            section_knowledge.deploy(old_student_conversation)
+            semantic_cache.invalidate((course_id, course_section))
+            return jsonify({"message": "Redeploy successfully"}), 200
+
+        except Exception as e:
+            db.session.rollback()
+            return jsonify({"message": "Redeploy failed"}), 400
 
 @bp.route("/generate_feedback", methods=["POST"])
 @jwt_required()
@@ -528,70 +756,38 @@ def generate_feedback():
     if student_conversation is None:
         return jsonify({"message": "The course is not deployed."}), 404
 
-    students = Student.query.filter_by(course=course_id).all()
-    
     try:
-        for student in students:
-            conversation, conversation_history = aistudent.load_conversation_history(
-                course_id,
-                course_section_id,
-                student.id
-            )
-            
-            if not conversation:
-                continue
-            
-            summary_prompt = "請總結以下對話的重點，幫助老師了解學生的學習狀況，如果對話是空白的，則回覆\"學生尚未進行對話\"，不要自己改變文字：\n\n"
-            for _, sender, a, _ in conversation_history:
-                if sender == 'user':
-                    summary_prompt += f"學生說: {a} "
-                elif sender == 'assistant':
-                    summary_prompt += f"AI 助教回: {a} \n\n"
-                # summary_prompt += f"學生: {q}\nAI 助教: {a}\n\n"
-            
-            print(summary_prompt)
-            
-            llm_summary = ChatOpenAI(
-                api_key=current_app.config["OPENAI_API_KEY"],
-                max_tokens=1500,
-                model_name="gpt-4"  # 確保使用正確的模型名稱
-            )
-            messages = [
-                SystemMessage(content="您是一位 AI 助教，請根據以下對話歷史生成一個詳細的總結，幫助老師了解學生的學習狀況。"),
-                HumanMessage(content=summary_prompt)
-            ]
-            
-            response = llm_summary(messages)
-            
-            summary = response.content.strip()
-            
-            print("\n從 LLM 收到的回應:")
-            print(summary)
-            
-            old_student_feedback = StudentAIFeedbacks.query.filter_by(
-                user_id = student.id,
-                conversation_id=student_conversation.id,
-            ).first()
-            
-            if old_student_feedback is None:
-                student_feedback = StudentAIFeedbacks(
-                    user_id = student.id,
-                    conversation_id=student_conversation.id,
-                    feedback = summary
-                )
-                
-                db.session.add(student_feedback)
-                db.session.commit()
-            else:
-                old_student_feedback.feedback = summary
-                db.session.commit()
-                
-        return jsonify({"message": "Feedback generated sucessfully."})
-        
+        job = feedback_generator.start(
+            course_id, course_section_id, user_id, student_conversation
+        )
+        return jsonify(
+            {"message": "Feedback generation started.", "job": job.to_dict()}
+        ), 202
+
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "An error occurred while generating the feedback"}), 500
-    
+
+
+@bp.route("/feedback_jobs/<int:job_id>", methods=["GET"])
+@jwt_required()
+def get_feedback_job(job_id):
+    claims = get_jwt()
+    user_type = claims.get("user_type")
+    user_id = claims.get("user_id")
+
+    if not user_type or not user_id:
+        return jsonify({"message": "Invalid token."}), 400
+
+    if user_type != "teacher":
+        return jsonify({"message": "Access forbidden"}), 403
+
+    job = FeedbackJobs.query.get(job_id)
+    if job is None or job.teacher_id != user_id:
+        return jsonify({"message": "Job not found."}), 404
+
+    return jsonify({"job": job.to_dict()}), 200
+
 @bp.route("/list_feedback/<int:course_id>/<int:course_section_id>", methods=["GET"])
 @jwt_required()
 def list_feedback(course_id, course_section_id):
@@ -647,4 +843,19 @@ def list_feedback(course_id, course_section_id):
     except Exception as e:
         db.session.rollback()
         return jsonify({"message": "An error occurred while fetching the feedback"}), 500
-    
\ No newline at end of file
+    
+
+
+@bp.route("/ai_metrics", methods=["GET"])
+@jwt_required()
+def ai_metrics():
+    claims = get_jwt()
+    user_type = claims.get("user_type")
+    user_id = claims.get("user_id")
+    if not user_type or not user_id:
+        return jsonify({"message": "Invalid token."}), 400
+
+    if user_type != "teacher":
+        return jsonify({"message": "Access forbidden"}), 403
+
+    return jsonify(metrics.snapshot()), 200
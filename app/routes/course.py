@@ -1,6 +1,10 @@
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, get_jwt
-from app.models import Course, Teacher, db, CourseSections,Student
+from app.models import Course, Teacher, db, CourseSections,Student, VectorStorageReports
+from app.services.course_index import course_index
+from app.services.ingestion import ingestion
+from app.services.storage_report import storage_reports
+from app.services.vector_index import STORAGE_TYPES, index_factory
 from datetime import datetime
 
 bp = Blueprint("course", __name__)
@@ -168,6 +172,104 @@ def update_course_data():
         return jsonify({"message": "An error occurred while updating the course"}), 500
 
 
+def _owned_course(course_id):
+    """回傳 (course, 錯誤回應)；只有課程的老師可以存取"""
+    claims = get_jwt()
+    if claims.get("user_type") != "teacher":
+        return None, (jsonify({"message": "Access forbidden: Teachers only."}), 403)
+
+    course = Course.query.get(course_id)
+    if not course:
+        return None, (jsonify({"message": "Course not found."}), 404)
+    if course.teacher_id != claims.get("user_id"):
+        return None, (
+            jsonify({"message": "Access forbidden: Not the owner of this course."}),
+            403,
+        )
+    return course, None
+
+
+@bp.route("/courses/<int:course_id>/vector_storage", methods=["GET"])
+@jwt_required()
+# 取得課程目前的向量儲存方式與最近一次的比較報告
+def get_vector_storage(course_id):
+    course, error = _owned_course(course_id)
+    if error:
+        return error
+
+    report = storage_reports.latest(course_id)
+    return jsonify(
+        {
+            "storage": ingestion.storage_for(course_id),
+            "default": index_factory.storage,
+            "report": report.to_dict() if report else None,
+        }
+    ), 200
+
+
+@bp.route("/courses/<int:course_id>/vector_storage/report", methods=["POST"])
+@jwt_required()
+# 在背景比較各種向量儲存方式在這門課的索引大小與 recall，供老師選擇
+def create_vector_storage_report(course_id):
+    course, error = _owned_course(course_id)
+    if error:
+        return error
+
+    report = storage_reports.latest(course_id)
+    if report is None or report.status not in ("pending", "running"):
+        top_k = (request.get_json(silent=True) or {}).get("top_k", 10)
+        if not isinstance(top_k, int):
+            return jsonify({"message": "top_k must be an integer"}), 400
+        report = storage_reports.enqueue(course_id, top_k)
+    return jsonify({"report": report.to_dict()}), 202
+
+
+@bp.route("/courses/<int:course_id>/vector_storage/report/<int:report_id>", methods=["GET"])
+@jwt_required()
+# 查詢比較報告的狀態與結果
+def get_vector_storage_report(course_id, report_id):
+    course, error = _owned_course(course_id)
+    if error:
+        return error
+
+    report = VectorStorageReports.query.get(report_id)
+    if not report or report.course_id != course_id:
+        return jsonify({"message": "Report not found."}), 404
+    return jsonify({"report": report.to_dict()}), 200
+
+
+@bp.route("/courses/<int:course_id>/vector_storage", methods=["PUT"])
+@jwt_required()
+# 變更課程的向量儲存方式，並在背景以新的方式重建索引
+def update_vector_storage(course_id):
+    course, error = _owned_course(course_id)
+    if error:
+        return error
+
+    storage = (request.get_json() or {}).get("storage")
+    if storage is not None and storage not in STORAGE_TYPES:
+        return jsonify(
+            {"message": f"storage must be one of {', '.join(STORAGE_TYPES)} or null"}
+        ), 400
+
+    previous = ingestion.storage_for(course_id)
+    course.vector_storage = storage
+    db.session.commit()
+
+    jobs = []
+    if ingestion.storage_for(course_id) != previous:
+        # 課程索引在建立時決定儲存方式，整個重建；各檔案的索引由背景工作改用新的儲存方式
+        course_index.drop(course_id)
+        jobs = ingestion.backfill_course(course_id)
+
+    return jsonify(
+        {
+            "storage": ingestion.storage_for(course_id),
+            "jobs": [job.to_dict() for job in jobs],
+        }
+    ), 200
+
+
 @bp.route("/getSections/<int:course_id>", methods=["GET"])
 @jwt_required()
 # 取得每週課程資訊
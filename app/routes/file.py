@@ -3,7 +3,8 @@ import hashlib
 from flask import Blueprint, request, jsonify, current_app, send_file
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import jwt_required, get_jwt
-from app.models import TeacherFiles, StudentFiles, db
+from app.models import TeacherFiles, StudentFiles, IngestionJobs, db
+from app.services.ingestion import ingestion
 
 
 
@@ -103,19 +104,80 @@ def upload_pdf():
             uploader_id, uploader_type, course_id, filename, filepath
         )
         if file_id:
-            return jsonify(
-                {
-                    "message": "PDF file uploaded successfully",
-                    "filename": filename,
-                    "file_id": file_id,
-                }
-            ), 200
+            response = {
+                "message": "PDF file uploaded successfully",
+                "filename": filename,
+                "file_id": file_id,
+            }
+            # 教師上傳的 PDF 在背景建立索引
+            if uploader_type == "teacher":
+                job = ingestion.enqueue(file_id)
+                response["ingestion_job_id"] = job.id
+                # 同一門課還沒加入課程索引的舊檔案一併排入佇列
+                ingestion.backfill_course(course_id)
+            return jsonify(response), 200
         else:
             return jsonify({"error": "Failed to save file info"}), 500
     else:
         return jsonify({"error": "File type not allowed"}), 400
 
 
+# API: 查詢 PDF 背景索引工作的狀態
+@bp.route("/api/ingestion_jobs/<int:job_id>", methods=["GET"])
+@jwt_required()
+def get_ingestion_job(job_id):
+    claims = get_jwt()
+    user_type = claims.get("user_type")
+    user_id = claims.get("user_id")
+
+    if user_type != "teacher":
+        return jsonify({"error": "Access forbidden."}), 403
+
+    job = IngestionJobs.query.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    file_record = TeacherFiles.query.get(job.file_id)
+    if not file_record or file_record.teacher_id != user_id:
+        return jsonify({"error": "Job not found"}), 404
+
+    return jsonify({"job": job.to_dict()}), 200
+
+
+# API: 刪除教師上傳的檔案，並從課程索引中移除
+@bp.route("/api/files/<int:file_id>", methods=["DELETE"])
+@jwt_required()
+def delete_file(file_id):
+    claims = get_jwt()
+    user_type = claims.get("user_type")
+    user_id = claims.get("user_id")
+
+    if user_type != "teacher":
+        return jsonify({"error": "Access forbidden."}), 403
+
+    file_record = TeacherFiles.query.filter_by(id=file_id, teacher_id=user_id).first()
+    if not file_record:
+        return jsonify({"error": "File not found"}), 404
+
+    try:
+        index_names = ingestion.remove(file_record)
+        file_path = file_record.path
+        course_id = file_record.course_id
+        db.session.delete(file_record)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error deleting file {file_id}: {e}")
+        return jsonify({"error": "An error occurred while deleting the file"}), 500
+
+    # 與磁碟上的檔案相同，確定刪除紀錄後才移除索引資料
+    ingestion.remove_index_data(course_id, file_id, index_names)
+    if os.path.exists(file_path):
+        os.remove(file_path)
+
+    return jsonify({"message": f"File {file_id} has been deleted."}), 200
+
+
 # 新增其他檔案類型的上傳功能
 @bp.route("/api/upload_various_file", methods=["POST"])
 @jwt_required()
@@ -1,4 +1,3 @@
-import json
 import os
 import pathlib
 import re
@@ -7,19 +6,25 @@ import faiss
 import fitz  # PyMuPDF
 import numpy as np
 from langchain.schema import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from sentence_transformers import SentenceTransformer
+from sqlalchemy.exc import IntegrityError
 
 from app.models import (
     StudentAIConversations,
-    TeacherAIConversations,
     StudentAIMessages,
-    TeacherAIMessages,
+    StudentAIMemories,
     db,
 )
+from app.services.chunk_store import load_chunks
+from app.services.embedding import embedding_service
+from app.services.index_cache import index_cache
+from app.services.llm_gateway import llm_gateway
+from app.services.llm_scheduler import DEFAULT_SCOPE
+from app.services.vector_index import index_factory, read_index
 
 
 class AIStudent:
+    FALLBACK_ANSWER = "抱歉，我無法處理您的請求。"
+
     def __init__(self, open_api_key):
         current_dir = pathlib.Path(__file__).parent.absolute()
         self.save_dir = os.path.join(current_dir, "saved_data")
@@ -29,48 +34,51 @@ class AIStudent:
         print(f"保存目錄路徑: {self.save_dir}")
 
         self.openai_api_key = open_api_key
-        self.llm = ChatOpenAI(
-            api_key=self.openai_api_key, max_tokens=4096, model_name="gpt-4o"
-        )
-        self.model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-        self.system_context = None
-
-    def load_teacher_conversation_history(self, course_id):
-        conversations = TeacherAIConversations.query.filter_by(course_id=course_id).all()
-        if not conversations:
-            return []
-        history = []
-        for conversation in conversations:
-            messages = (
-                TeacherAIMessages.query.filter_by(conversation_id=conversation.id)
-                .order_by(TeacherAIMessages.sent_at)
-                .all()
-            )
-            for msg in messages:
-                history.append((msg.id, msg.sender, msg.message, msg.sent_at))
-            # history.append(
-            #     (msg.id, msg.sender, msg.message, msg.sent_at) for msg in messages
-            # )
-        # history = [(msg.id, msg.sender, msg.message, msg.sent_at) for msg in messages]
-        return history
-
-    def load_conversation_history(self, course_id, course_section, student_id):
+        self.model_name = "gpt-4o"
+        self.max_tokens = 4096
+        # 與其他服務共用同一份嵌入模型
+        self.model = embedding_service
+
+    def load_conversation_history(
+        self, course_id, course_section, student_id, after_id=None, until_id=None
+    ):
+        """回傳 (conversation, history)；只載入 id 在 (after_id, until_id] 範圍內的訊息"""
         conversation = StudentAIConversations.query.filter_by(
             course_id=course_id, course_section=course_section
         ).first()
         if not conversation:
             return None, []
 
-        messages = (
-            StudentAIMessages.query.filter_by(
-                conversation_id=conversation.id, student_id=student_id
-            )
-            .order_by(StudentAIMessages.sent_at)
-            .all()
+        query = StudentAIMessages.query.filter_by(
+            conversation_id=conversation.id, student_id=student_id
         )
+        if after_id:
+            query = query.filter(StudentAIMessages.id > after_id)
+        if until_id is not None:
+            query = query.filter(StudentAIMessages.id <= until_id)
+        messages = query.order_by(StudentAIMessages.sent_at).all()
         history = [(msg.id, msg.sender, msg.message, msg.sent_at) for msg in messages]
         return conversation, history
 
+    def get_memory(self, conversation_id, student_id):
+        memory = StudentAIMemories.query.filter_by(
+            conversation_id=conversation_id, student_id=student_id
+        ).first()
+        if memory is None:
+            memory = StudentAIMemories(
+                conversation_id=conversation_id, student_id=student_id
+            )
+            db.session.add(memory)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # 同時送出的第一則訊息已建立記憶，改用那一筆
+                db.session.rollback()
+                memory = StudentAIMemories.query.filter_by(
+                    conversation_id=conversation_id, student_id=student_id
+                ).one()
+        return memory
+
     def save_message(self, conversation_id, user_id, sender, message):
         new_message = StudentAIMessages(
             conversation_id=conversation_id,
@@ -81,15 +89,20 @@ class AIStudent:
         db.session.add(new_message)
         db.session.commit()
 
-    def load_faiss_index(self, name="current"):
-        """載入 FAISS 索引和對應的句子"""
+    def load_faiss_index(self, name="current", checksum=None):
+        """載入 FAISS 索引和對應的句子（優先使用行程內快取）"""
+        key = index_cache.make_key(name, checksum)
+        return index_cache.get_or_load(key, lambda: self._read_faiss_index(name))
+
+    def _read_faiss_index(self, name):
         try:
             index_path = os.path.join(self.save_dir, f"{name}_index.faiss")
-            index = faiss.read_index(index_path)
+            index = read_index(index_path)
+            meta = index_factory.load_meta(index_path, index)
+            index = index_factory.attach_rerank(index_path, index, meta)
 
-            sentences_path = os.path.join(self.save_dir, f"{name}_sentences.json")
-            with open(sentences_path, "r", encoding="utf-8") as f:
-                sentences = json.load(f)
+            # 段落以 mmap 開啟，只有搜尋結果會被解碼
+            sentences = load_chunks(self.save_dir, name)
 
             return index, sentences
         except Exception as e:
@@ -99,16 +112,28 @@ class AIStudent:
     def search_rag(self, query, index, sentences, top_k=10):
         try:
             query_embedding = self.model.encode([query])
-            distances, indices = index.search(query_embedding, top_k)
-            return [sentences[i] for i in indices[0]]
+            _, indices = index_factory.search(index, query_embedding, top_k)
+            # 結果不足 top_k 時 FAISS 以 -1 補齊
+            return [sentences[i] for i in indices[0] if i >= 0]
         except Exception as e:
             print(f"Error during RAG search: {e}")
             return []
 
-    def generate_response(self, messages):
+    def invoke(self, messages, scope=DEFAULT_SCOPE):
+        """呼叫 LLM，失敗時丟出例外"""
+        return llm_gateway.invoke(messages, self.model_name, self.max_tokens, scope)
+
+    def generate_response(self, messages, scope=DEFAULT_SCOPE):
         try:
-            response = self.llm.invoke(messages)
-            return response.content.strip()
+            return llm_gateway.invoke(messages, self.model_name, self.max_tokens, scope)
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "抱歉，我無法處理您的請求。"
+            return self.FALLBACK_ANSWER
+
+    def generate_response_stream(self, messages, scope=DEFAULT_SCOPE):
+        """逐段產生回應文字"""
+        try:
+            yield from llm_gateway.stream(messages, self.model_name, self.max_tokens, scope)
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield self.FALLBACK_ANSWER
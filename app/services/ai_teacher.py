@@ -1,23 +1,25 @@
-import json
 import os
 import pathlib
-import re
 
 import faiss
-import fitz  # PyMuPDF
-import numpy as np
 from langchain.schema import HumanMessage, SystemMessage
-from langchain_openai import ChatOpenAI
-from sentence_transformers import SentenceTransformer
 
 from app.models import (
     TeacherAIConversations,
     TeacherAIMessages,
     db,
 )
+from app.services.chunk_store import chunks_path, load_chunks, write_chunks
+from app.services.embedding import embedding_service
+from app.services.index_cache import index_cache
+from app.services.llm_gateway import llm_gateway
+from app.services.llm_scheduler import BATCH, DEFAULT_SCOPE, CallScope
+from app.services.vector_index import index_factory, read_index
 
 
 class AITeacher:
+    FALLBACK_ANSWER = "抱歉，我無法處理您的請求。"
+
     def __init__(self, open_api_key):
         current_dir = pathlib.Path(__file__).parent.absolute()
         self.save_dir = os.path.join(current_dir, "saved_data")
@@ -27,13 +29,12 @@ class AITeacher:
         print(f"保存目錄路徑: {self.save_dir}")
 
         self.openai_api_key = open_api_key
-        self.llm = ChatOpenAI(
-            api_key=self.openai_api_key, max_tokens=4096, model_name="gpt-4o"
-        )
-        self.model = SentenceTransformer("paraphrase-multilingual-MiniLM-L12-v2")
-        self.system_context = None
+        self.model_name = "gpt-4o"
+        self.max_tokens = 4096
+        # 與其他服務共用同一份嵌入模型
+        self.model = embedding_service
 
-    def summarize_text(self, text):
+    def summarize_text(self, text, scope=CallScope(priority=BATCH)):
         messages = [
             SystemMessage(
                 content="以下為教師傳給 AI 的問題，請用一段文字總結教師的問題，不要加上主詞"
@@ -42,22 +43,22 @@ class AITeacher:
         ]
 
         try:
-            summary = self.generate_response(messages)
+            summary = self.generate_response(messages, scope)
             return summary
         except Exception as e:
             print(f"Error generating summary: {e}")
             return "無法生成摘要。"
 
-    def load_conversation_history(self, conversation_uuid):
+    def load_conversation_history(self, conversation_uuid, since_summary=False):
         conversation = TeacherAIConversations.query.filter_by(uuid=conversation_uuid).first()
         if not conversation:
             return None, []
 
-        messages = (
-            TeacherAIMessages.query.filter_by(conversation_id=conversation.id)
-            .order_by(TeacherAIMessages.sent_at)
-            .all()
-        )
+        query = TeacherAIMessages.query.filter_by(conversation_id=conversation.id)
+        # 已併入摘要的訊息不必再載入
+        if since_summary and conversation.summarized_until:
+            query = query.filter(TeacherAIMessages.id > conversation.summarized_until)
+        messages = query.order_by(TeacherAIMessages.sent_at).all()
         history = [(msg.id, msg.sender, msg.message, msg.sent_at) for msg in messages]
         return conversation, history
 
@@ -68,85 +69,27 @@ class AITeacher:
         db.session.add(new_message)
         db.session.commit()
 
-    def extract_text_from_pdf(self, pdf_path):
-        """從 PDF 提取文本"""
-        try:
-            pdf_absolute_path = os.path.abspath(pdf_path)
-            print(f"PDF 文件路徑: {pdf_absolute_path}")  # 調試信息
-
-            if not os.path.exists(pdf_absolute_path):
-                print(f"PDF 文件不存在: {pdf_absolute_path}")
-                return ""
-
-            doc = fitz.open(pdf_absolute_path)
-            text = ""
-            for page in doc:
-                text += page.get_text()
-
-            print(f"提取的文本長度: {len(text)}")  # 調試信息
-            return text
-
-        except Exception as e:
-            print(f"提取 PDF 文本時發生錯誤: {str(e)}")
-            import traceback
-
-            print(traceback.format_exc())
-            return ""
-
-    def build_faiss_index(self, text, save_name=None):
-        try:
-            # 分割句子並移除空白行
-            sentences = re.split('(?<=[。！？])', text)
-            sentences = [s.strip() for s in sentences if s.strip()]
-            print(f"總句子數: {len(sentences)}")  # 調試信息
-
-            if not sentences:
-                print("警告：沒有找到有效的句子")
-                return None, None
-
-            # 生成嵌入向量
-            print("開始生成嵌入向量...")  # 調試信息
-            embeddings = self.model.encode(sentences)
-            embeddings = embeddings.astype(np.float32)
-            print(f"嵌入向量形狀: {embeddings.shape}")  # 調試信息
-
-            # 建立索引
-            dimension = embeddings.shape[1]
-            index = faiss.IndexFlatL2(dimension)
-            index.add(embeddings)
-            print(f"索引中的向量數: {index.ntotal}")  # 調試信息
-
-            # 如果提供了保存名稱，則保存索引
-            if save_name:
-                save_success = self.save_faiss_index(index, sentences, save_name)
-                if save_success:
-                    print("索引保存成功")
-                else:
-                    print("索引保存失敗")
-
-            return index, sentences
-
-        except Exception as e:
-            print(f"建立 FAISS 索引時發生錯誤: {str(e)}")
-            import traceback
-
-            print(traceback.format_exc())
-            return None, None
-
     def save_faiss_index(self, index, sentences, name="current"):
-        """保存 FAISS 索引和對應的句子"""
+        """保存 FAISS 索引和對應的句子；sentences 為 None 時只保存索引"""
         try:
+            os.makedirs(self.save_dir, exist_ok=True)
             index_path = os.path.join(self.save_dir, f"{name}_index.faiss")
-            sentences_path = os.path.join(self.save_dir, f"{name}_sentences.json")
+            sentences_path = chunks_path(self.save_dir, name)
 
-            # 保存 FAISS 索引
-            faiss.write_index(index, index_path)
+            # 舊的快取內容已過期
+            index_cache.invalidate(name)
+
+            # 保存 FAISS 索引；其他 worker 可能正以 mmap 讀取舊檔，先寫暫存檔再替換
+            tmp_index_path = f"{index_path}.tmp"
+            faiss.write_index(index, tmp_index_path)
+            os.replace(tmp_index_path, index_path)
+            index_factory.save_meta(index_path, index)
             print(f"FAISS 索引已保存到: {index_path}")  # 調試信息
 
-            # 保存對應的句子
-            with open(sentences_path, "w", encoding="utf-8") as f:
-                json.dump(sentences, f, ensure_ascii=False, indent=2)
-            print(f"句子數據已保存到: {sentences_path}")  # 調試信息
+            # 保存對應的句子；ingestion 已逐批寫入時傳入 None
+            if sentences is not None:
+                write_chunks(sentences_path, sentences)
+                print(f"句子數據已保存到: {sentences_path}")  # 調試信息
 
             # 驗證文件是否確實被創建
             if os.path.exists(index_path) and os.path.exists(sentences_path):
@@ -166,15 +109,20 @@ class AITeacher:
             print(traceback.format_exc())  # 打印完整的錯誤堆疊
             return False
 
-    def load_faiss_index(self, name="current"):
-        """載入 FAISS 索引和對應的句子"""
+    def load_faiss_index(self, name="current", checksum=None):
+        """載入 FAISS 索引和對應的句子（優先使用行程內快取）"""
+        key = index_cache.make_key(name, checksum)
+        return index_cache.get_or_load(key, lambda: self._read_faiss_index(name))
+
+    def _read_faiss_index(self, name):
         try:
             index_path = os.path.join(self.save_dir, f"{name}_index.faiss")
-            index = faiss.read_index(index_path)
+            index = read_index(index_path)
+            meta = index_factory.load_meta(index_path, index)
+            index = index_factory.attach_rerank(index_path, index, meta)
 
-            sentences_path = os.path.join(self.save_dir, f"{name}_sentences.json")
-            with open(sentences_path, "r", encoding="utf-8") as f:
-                sentences = json.load(f)
+            # 段落以 mmap 開啟，只有搜尋結果會被解碼
+            sentences = load_chunks(self.save_dir, name)
 
             return index, sentences
         except Exception as e:
@@ -184,16 +132,28 @@ class AITeacher:
     def search_rag(self, query, index, sentences, top_k=10):
         try:
             query_embedding = self.model.encode([query])
-            distances, indices = index.search(query_embedding, top_k)
-            return [sentences[i] for i in indices[0]]
+            _, indices = index_factory.search(index, query_embedding, top_k)
+            # 結果不足 top_k 時 FAISS 以 -1 補齊
+            return [sentences[i] for i in indices[0] if i >= 0]
         except Exception as e:
             print(f"Error during RAG search: {e}")
             return []
 
-    def generate_response(self, messages):
+    def invoke(self, messages, scope=DEFAULT_SCOPE):
+        """呼叫 LLM，失敗時丟出例外"""
+        return llm_gateway.invoke(messages, self.model_name, self.max_tokens, scope)
+
+    def generate_response(self, messages, scope=DEFAULT_SCOPE):
         try:
-            response = self.llm.invoke(messages)
-            return response.content.strip()
+            return llm_gateway.invoke(messages, self.model_name, self.max_tokens, scope)
         except Exception as e:
             print(f"Error generating response: {e}")
-            return "抱歉，我無法處理您的請求。"
+            return self.FALLBACK_ANSWER
+
+    def generate_response_stream(self, messages, scope=DEFAULT_SCOPE):
+        """逐段產生回應文字"""
+        try:
+            yield from llm_gateway.stream(messages, self.model_name, self.max_tokens, scope)
+        except Exception as e:
+            print(f"Error streaming response: {e}")
+            yield self.FALLBACK_ANSWER
@@ -0,0 +1,34 @@
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from app.models import db
+
+
+class BackgroundExecutor:
+    """在背景執行緒中執行工作，每個工作都會推入 app context 並在結束時釋放 DB session"""
+
+    def __init__(self, name, max_workers=1):
+        self.name = name
+        self.max_workers = max_workers
+        self._executor = None
+
+    def _get_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix=self.name
+            )
+        return self._executor
+
+    def submit(self, app, fn, *args, **kwargs):
+        def run():
+            with app.app_context():
+                try:
+                    return fn(*args, **kwargs)
+                except Exception:
+                    print(f"[{self.name}] 背景工作發生錯誤:")
+                    print(traceback.format_exc())
+                    raise
+                finally:
+                    db.session.remove()
+
+        return self._get_executor().submit(run)
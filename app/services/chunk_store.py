@@ -0,0 +1,136 @@
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+# 檔案格式：MAGIC | count (uint64) | offsets (uint64 * (count + 1)) | UTF-8 blob
+MAGIC = b"CHUNKS01"
+_HEADER = struct.Struct("<8sQ")
+
+
+def _temp_file(path, suffix):
+    """與目標同目錄的唯一暫存檔，多個 worker 同時寫入同一個檔案時不會互相覆蓋"""
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.", suffix=suffix
+    )
+    return os.fdopen(fd, "wb"), tmp_path
+
+
+class ChunkWriter:
+    """逐批寫入段落，close() 時組成與 write_chunks 相同格式的檔案；段落內容不必全部留在記憶體"""
+
+    def __init__(self, path):
+        self.path = path
+        self._offsets = [0]
+        self._blob, self._blob_path = _temp_file(path, ".blob")
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, chunks):
+        for chunk in chunks:
+            data = chunk.encode("utf-8")
+            self._blob.write(data)
+            self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        self._blob.close()
+        f, tmp_path = _temp_file(self.path, ".tmp")
+        try:
+            with f, open(self._blob_path, "rb") as blob:
+                f.write(_HEADER.pack(MAGIC, len(self)))
+                f.write(np.asarray(self._offsets, dtype="<u8").tobytes())
+                shutil.copyfileobj(blob, f)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        finally:
+            os.remove(self._blob_path)
+
+    def abort(self):
+        self._blob.close()
+        if os.path.exists(self._blob_path):
+            os.remove(self._blob_path)
+
+
+def write_chunks(path, chunks):
+    """把字串列表寫成 UTF-8 blob 加上位移陣列"""
+    writer = ChunkWriter(path)
+    try:
+        writer.append(chunks)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+
+class ChunkStore:
+    """以 mmap 讀取的唯讀段落列表，只有被取用的段落才會解碼；多個 worker 共用同一份 page cache"""
+
+    # 供 index_cache 判斷：內容不在 Python heap 上
+    mmapped = True
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"Not a chunk store: {path}")
+        self._count = count
+        self._offsets = np.frombuffer(
+            self._mm, dtype="<u8", count=count + 1, offset=_HEADER.size
+        )
+        self._data_start = _HEADER.size + self._offsets.nbytes
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("chunk index out of range")
+        start = self._data_start + int(self._offsets[i])
+        end = self._data_start + int(self._offsets[i + 1])
+        return self._mm[start:end].decode("utf-8")
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self[i]
+
+
+def chunks_path(save_dir, name):
+    return os.path.join(save_dir, f"{name}_chunks.bin")
+
+
+def legacy_sentences_path(save_dir, name):
+    return os.path.join(save_dir, f"{name}_sentences.json")
+
+
+def load_chunks(save_dir, name):
+    """開啟 {name}_chunks.bin；只有舊版 {name}_sentences.json 時先轉換格式"""
+    path = chunks_path(save_dir, name)
+    if not os.path.exists(path):
+        legacy_path = legacy_sentences_path(save_dir, name)
+        try:
+            with open(legacy_path, "r", encoding="utf-8") as f:
+                sentences = json.load(f)
+        except FileNotFoundError:
+            # 其他 worker 已完成轉換並刪除舊檔
+            if not os.path.exists(path):
+                raise
+        else:
+            write_chunks(path, sentences)
+            try:
+                os.remove(legacy_path)
+            except FileNotFoundError:
+                pass
+    return ChunkStore(path)
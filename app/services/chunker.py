@@ -0,0 +1,89 @@
+import re
+
+# 中文句末標點、英文句末標點後接空白、換行（投影片的條列項目）都視為切分點
+_UNIT_BOUNDARY = re.compile(r"(?<=[。！？；])|(?<=[.!?;])(?=\s)|\n+")
+
+
+def split_units(text):
+    """把一頁文字切成句子或條列項目"""
+    units = []
+    for unit in _UNIT_BOUNDARY.split(text):
+        unit = " ".join(unit.split())
+        if unit:
+            units.append(unit)
+    return units
+
+
+class TokenChunker:
+    """把逐頁文字組合成 token 數有上限的段落，相鄰段落保留 overlap 個 token 的重疊，並記錄頁碼"""
+
+    def __init__(self, count_tokens, max_tokens=120, overlap_tokens=20):
+        if overlap_tokens >= max_tokens:
+            raise ValueError("overlap_tokens must be smaller than max_tokens")
+        self.count_tokens = count_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    def _split_long(self, unit):
+        """超過上限的單一句子依 token 數二分切開"""
+        pieces = []
+        rest = unit
+        while self.count_tokens(rest) > self.max_tokens:
+            low, high = 1, len(rest)
+            while low < high:
+                middle = (low + high + 1) // 2
+                if self.count_tokens(rest[:middle]) <= self.max_tokens:
+                    low = middle
+                else:
+                    high = middle - 1
+            # 盡量在空白處切開，避免切斷英文單字
+            cut = rest.rfind(" ", 0, low)
+            cut = cut if cut > low // 2 else low
+            pieces.append(rest[:cut].strip())
+            rest = rest[cut:].strip()
+        if rest:
+            pieces.append(rest)
+        return pieces
+
+    def _units(self, pages):
+        for page_no, text in pages:
+            for unit in split_units(text):
+                for piece in self._split_long(unit):
+                    yield page_no, piece, self.count_tokens(piece)
+
+    def _make_chunk(self, window):
+        return {
+            "text": " ".join(text for _, text, _ in window),
+            "page": window[0][0],
+            "page_end": window[-1][0],
+            "tokens": sum(tokens for _, _, tokens in window),
+        }
+
+    def chunks(self, pages):
+        """pages 為 (page_no, text) 的 iterable，逐一產生 {"text", "page", "page_end", "tokens"}"""
+        window = []
+        window_tokens = 0
+        fresh = 0  # 視窗中尚未輸出過的句子數
+        for page_no, text, tokens in self._units(pages):
+            if window and window_tokens + tokens > self.max_tokens:
+                yield self._make_chunk(window)
+
+                # 保留結尾的句子作為下一段的開頭
+                overlap = []
+                overlap_tokens = 0
+                for unit in reversed(window):
+                    if overlap_tokens + unit[2] > self.overlap_tokens:
+                        break
+                    overlap.insert(0, unit)
+                    overlap_tokens += unit[2]
+                while overlap and overlap_tokens + tokens > self.max_tokens:
+                    overlap_tokens -= overlap.pop(0)[2]
+                window, window_tokens = overlap, overlap_tokens
+                fresh = 0
+
+            window.append((page_no, text, tokens))
+            window_tokens += tokens
+            fresh += 1
+
+        if fresh:
+            yield self._make_chunk(window)
@@ -0,0 +1,272 @@
+import fcntl
+import json
+import os
+import pathlib
+import shutil
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+from app.services.embedding import embedding_service
+from app.services.metrics import metrics
+from app.services.vector_index import FLOAT32, FP16, index_factory, normalize
+
+# 向量 id 的高 32 位元是 file_id、低 32 位元是檔案內的段落編號，移除檔案時直接刪除整段 id 範圍
+FILE_ID_SHIFT = 32
+CHUNK_MASK = (1 << FILE_ID_SHIFT) - 1
+
+
+def make_id(file_id, chunk_no):
+    return (int(file_id) << FILE_ID_SHIFT) | chunk_no
+
+
+def split_id(vector_id):
+    return int(vector_id) >> FILE_ID_SHIFT, int(vector_id) & CHUNK_MASK
+
+
+class _CourseEntry:
+    def __init__(self, index, chunks, mtime):
+        self.index = index
+        self.chunks = chunks  # file_id -> [{"text", "page"}, ...]
+        self.mtime = mtime
+
+
+class CourseIndex:
+    """每門課一個 IndexIDMap2 索引，依檔案分段；上傳或刪除檔案時增量加入或移除向量"""
+
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+        self._courses = {}
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def init_app(self, app):
+        metrics.register("course_index", self.stats)
+
+    def remove_legacy_dirs(self):
+        """刪除依模型分目錄前的 courses/<course_id>/ 索引；舊索引不會再被讀取，檔案會由 backfill 重新加入
+
+        只由 backfill_course_index.py 執行一次，不在 app 啟動時執行
+        """
+        if not os.path.isdir(self.save_dir):
+            return
+        for name in os.listdir(self.save_dir):
+            path = os.path.join(self.save_dir, name)
+            # 模型目錄名稱不會是純數字
+            if name.isdigit() and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                print(f"已刪除舊版課程索引: {path}")
+
+    def _course_dir(self, course_id):
+        # 不同嵌入模型/後端的向量不可混用，各自一份課程索引
+        model_dir = embedding_service.model_id.replace("/", "__")
+        return os.path.join(self.save_dir, model_dir, str(course_id))
+
+    def _index_path(self, course_id):
+        return os.path.join(self._course_dir(course_id), "index.faiss")
+
+    def _chunks_path(self, course_id, file_id):
+        return os.path.join(self._course_dir(course_id), "files", f"{file_id}.json")
+
+    def _lock(self, course_id):
+        with self._locks_lock:
+            return self._locks.setdefault(str(course_id), threading.RLock())
+
+    @contextmanager
+    def _flock(self, course_id, operation):
+        os.makedirs(self._course_dir(course_id), exist_ok=True)
+        with open(os.path.join(self._course_dir(course_id), ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _write_lock(self, course_id):
+        """寫入時同時鎖住行程內與跨行程（多個 worker）的存取"""
+        with self._lock(course_id), self._flock(course_id, fcntl.LOCK_EX):
+            yield
+
+    def _load(self, course_id, locked=False):
+        """載入課程索引；其他行程更新過檔案時重新讀取
+
+        從檔案讀取時持有共用的跨行程鎖，不會讀到寫到一半的索引與段落；
+        已持有寫入鎖時傳入 locked=True
+        """
+        key = (embedding_service.model_id, str(course_id))
+        index_path = self._index_path(course_id)
+        mtime = os.path.getmtime(index_path) if os.path.exists(index_path) else None
+
+        entry = self._courses.get(key)
+        if entry is not None and entry.mtime == mtime:
+            return entry
+
+        if mtime is None:
+            entry = _CourseEntry(None, {}, None)
+        elif locked:
+            entry = self._read(course_id)
+        else:
+            with self._flock(course_id, fcntl.LOCK_SH):
+                entry = self._read(course_id)
+
+        self._courses[key] = entry
+        return entry
+
+    def _read(self, course_id):
+        import faiss
+
+        index_path = self._index_path(course_id)
+        if not os.path.exists(index_path):
+            # 取得鎖之前索引已被刪除
+            return _CourseEntry(None, {}, None)
+        mtime = os.path.getmtime(index_path)
+        index = faiss.read_index(index_path)
+        chunks = {}
+        files_dir = os.path.join(self._course_dir(course_id), "files")
+        for name in os.listdir(files_dir):
+            file_id, ext = os.path.splitext(name)
+            if ext != ".json" or not file_id.isdigit():
+                continue
+            with open(os.path.join(files_dir, name), "r", encoding="utf-8") as f:
+                chunks[int(file_id)] = json.load(f)
+        return _CourseEntry(index, chunks, mtime)
+
+    def _save(self, course_id, entry):
+        import faiss
+
+        index_path = self._index_path(course_id)
+        tmp_path = f"{index_path}.tmp"
+        faiss.write_index(entry.index, tmp_path)
+        os.replace(tmp_path, index_path)
+        entry.mtime = os.path.getmtime(index_path)
+
+    def _write_chunks(self, course_id, file_id, chunks):
+        path = self._chunks_path(course_id, file_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 暫存檔放在 files/ 之外，中斷時不會留下會被當成段落檔讀取的檔案
+        tmp_path = os.path.join(self._course_dir(course_id), f".{file_id}.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(chunks, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def add_file(self, course_id, file_id, chunks, embeddings=None, storage=FLOAT32):
+        """chunks 為 [{"text", "page"}, ...]；同一檔案重複加入時會先移除舊的向量
+
+        storage 只在課程索引第一次建立時使用；課程索引是增量加入的，沒有固定的訓練資料，
+        需要訓練的 sq8 / pq 改以 fp16 儲存
+        """
+        import faiss
+
+        if not chunks:
+            return 0
+
+        if embeddings is None:
+            embeddings = embedding_service.encode([c["text"] for c in chunks])
+        ids = np.array([make_id(file_id, i) for i in range(len(chunks))], dtype=np.int64)
+
+        with self._write_lock(course_id):
+            entry = self._load(course_id, locked=True)
+            if entry.index is None:
+                storage = FLOAT32 if storage == FLOAT32 else FP16
+                entry.index = faiss.IndexIDMap2(
+                    index_factory.flat_index(np.shape(embeddings)[1], storage)
+                )
+            elif int(file_id) in entry.chunks:
+                self._remove_vectors(entry, file_id)
+
+            # 先寫段落內容再寫索引，其他行程看到新索引時段落一定已存在
+            self._write_chunks(course_id, file_id, chunks)
+            # embeddings 可能是 mmap，分批正規化後加入，不複製整份向量
+            batch = index_factory.add_batch_size
+            for start in range(0, len(ids), batch):
+                entry.index.add_with_ids(
+                    normalize(embeddings[start : start + batch]), ids[start : start + batch]
+                )
+            entry.chunks[int(file_id)] = chunks
+            self._save(course_id, entry)
+
+        metrics.incr("course_index.vectors_added", len(chunks))
+        return len(chunks)
+
+    def _remove_vectors(self, entry, file_id):
+        import faiss
+
+        selector = faiss.IDSelectorRange(make_id(file_id, 0), make_id(int(file_id) + 1, 0))
+        return entry.index.remove_ids(selector)
+
+    def remove_file(self, course_id, file_id):
+        with self._write_lock(course_id):
+            entry = self._load(course_id, locked=True)
+            if entry.index is None:
+                return 0
+
+            removed = self._remove_vectors(entry, file_id)
+            self._save(course_id, entry)
+            entry.chunks.pop(int(file_id), None)
+
+            path = self._chunks_path(course_id, file_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+        metrics.incr("course_index.vectors_removed", removed)
+        return removed
+
+    def drop(self, course_id):
+        """刪除整個課程索引（例如變更儲存方式後重建）"""
+        with self._write_lock(course_id):
+            index_path = self._index_path(course_id)
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            files_dir = os.path.join(self._course_dir(course_id), "files")
+            if os.path.isdir(files_dir):
+                shutil.rmtree(files_dir)
+            self._courses.pop((embedding_service.model_id, str(course_id)), None)
+
+    def has_file(self, course_id, file_id):
+        with self._lock(course_id):
+            return int(file_id) in self._load(course_id).chunks
+
+    def search(self, course_id, query, top_k=10, query_embedding=None):
+        """在整門課的所有檔案中搜尋，回傳 [{"file_id", "page", "text", "score"}, ...]"""
+        if query_embedding is None:
+            query_embedding = embedding_service.encode([query])
+        query_embedding = normalize(query_embedding)
+
+        with self._lock(course_id):
+            entry = self._load(course_id)
+            if entry.index is None or entry.index.ntotal == 0:
+                return []
+            scores, ids = entry.index.search(query_embedding, min(top_k, entry.index.ntotal))
+
+            hits = []
+            for score, vector_id in zip(scores[0], ids[0]):
+                if vector_id < 0:
+                    continue
+                file_id, chunk_no = split_id(vector_id)
+                chunk = entry.chunks.get(file_id)
+                if chunk is None or chunk_no >= len(chunk):
+                    continue
+                hits.append(
+                    {
+                        "file_id": file_id,
+                        "page": chunk[chunk_no]["page"],
+                        "text": chunk[chunk_no]["text"],
+                        "score": float(score),
+                    }
+                )
+        return hits
+
+    def stats(self):
+        return {
+            "courses_loaded": len(self._courses),
+            "vectors": sum(
+                entry.index.ntotal for entry in self._courses.values() if entry.index is not None
+            ),
+        }
+
+
+course_index = CourseIndex(
+    os.path.join(pathlib.Path(__file__).parent.absolute(), "saved_data", "courses")
+)
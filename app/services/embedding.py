@@ -0,0 +1,148 @@
+import os
+import pathlib
+import queue
+import threading
+import time
+
+import numpy as np
+
+from app.services.encoder_backends import TORCH, load_encoder, model_id
+from app.services.metrics import metrics
+
+
+class _PendingEncode:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingService:
+    """每個行程共用一份 SentenceTransformer，並把多個請求執行緒的 encode 合併成一次批次運算"""
+
+    def __init__(
+        self,
+        model_name="paraphrase-multilingual-MiniLM-L12-v2",
+        max_batch_size=64,
+        max_wait_ms=5,
+    ):
+        self.model_name = model_name
+        self.backend = TORCH
+        self.quantization = "avx2"
+        self.export_dir = os.path.join(
+            pathlib.Path(__file__).parent.absolute(), "saved_data", "onnx"
+        )
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._model = None
+        self._model_lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._worker = None
+        self._worker_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.model_name = app.config.get("EMBEDDING_MODEL", self.model_name)
+        self.backend = app.config.get("EMBEDDING_BACKEND", self.backend)
+        self.quantization = app.config.get("EMBEDDING_QUANTIZATION", self.quantization)
+        self.max_batch_size = app.config.get("EMBEDDING_MAX_BATCH_SIZE", self.max_batch_size)
+        self.max_wait_ms = app.config.get("EMBEDDING_MAX_WAIT_MS", self.max_wait_ms)
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    print(f"載入嵌入模型: {self.model_name} ({self.backend})")
+                    self._model = load_encoder(
+                        self.model_name, self.backend, self.export_dir, self.quantization
+                    )
+        return self._model
+
+    @property
+    def model_id(self):
+        return model_id(self.model_name, self.backend, self.quantization)
+
+    @property
+    def max_seq_length(self):
+        return self.model.max_seq_length
+
+    def count_tokens(self, text):
+        """以嵌入模型的 tokenizer 計算 token 數（不含特殊 token）"""
+        return len(self.model.tokenizer.tokenize(text))
+
+    def _ensure_worker(self):
+        if self._worker is None:
+            with self._worker_lock:
+                if self._worker is None:
+                    self._worker = threading.Thread(
+                        target=self._loop, name="embedding-batcher", daemon=True
+                    )
+                    self._worker.start()
+
+    def encode(self, sentences, **kwargs):
+        """與 SentenceTransformer.encode 相同的介面；小量請求會與其他執行緒合併批次"""
+        if isinstance(sentences, str):
+            return self.encode([sentences], **kwargs)[0]
+
+        sentences = list(sentences)
+
+        # 大量文字（例如建立索引）或帶有額外參數時直接運算，不進入批次佇列
+        if kwargs or len(sentences) >= self.max_batch_size:
+            metrics.observe("embedding.batch_size", len(sentences))
+            return self.model.encode(sentences, **kwargs)
+
+        self._ensure_worker()
+        pending = _PendingEncode(sentences)
+        self._queue.put(pending)
+        metrics.gauge("embedding.queue_depth", self._queue.qsize())
+
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _collect_batch(self):
+        batch = [self._queue.get()]
+        count = len(batch[0].sentences)
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+
+        while count < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            count += len(pending.sentences)
+
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect_batch()
+            metrics.gauge("embedding.queue_depth", self._queue.qsize())
+
+            texts = [s for pending in batch for s in pending.sentences]
+            metrics.observe("embedding.batch_size", len(texts))
+            metrics.observe("embedding.requests_per_batch", len(batch))
+
+            try:
+                embeddings = np.asarray(self.model.encode(texts))
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+                    pending.done.set()
+                continue
+
+            offset = 0
+            for pending in batch:
+                size = len(pending.sentences)
+                pending.result = embeddings[offset : offset + size]
+                offset += size
+                pending.done.set()
+
+
+embedding_service = EmbeddingService()
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+from app.services.metrics import metrics
+
+# SQLite 單一查詢的參數數量上限
+_LOOKUP_BATCH = 500
+# 命中時最多每天更新一次 used_at，避免每次讀取都寫入
+_TOUCH_SECONDS = 86400
+
+
+def chunk_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """以 (模型名稱, sha256(段落)) 為鍵保存 float16 嵌入向量的 SQLite 快取，內容相近的檔案不必重新嵌入
+
+    每筆記錄最後使用的時間；超過 max_age_days 沒有使用，或總筆數超過 max_entries 時由最久未使用的開始刪除，
+    不再使用的模型的向量也會因此被清掉
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.enabled = True
+        self.max_entries = 500_000
+        self.max_age_days = 90
+        self.prune_interval = 3600
+        # 每個段落的平均嵌入時間，用於估算快取省下的時間
+        self.seconds_per_chunk = None
+        self._last_prune = 0.0
+        self._local = threading.local()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("EMBEDDING_CACHE_ENABLED", self.enabled)
+        self.path = app.config.get("EMBEDDING_CACHE_PATH") or self.path
+        self.max_entries = app.config.get("EMBEDDING_CACHE_MAX_ENTRIES", self.max_entries)
+        self.max_age_days = app.config.get("EMBEDDING_CACHE_MAX_AGE_DAYS", self.max_age_days)
+        metrics.register("embedding_cache", self.stats)
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL 讓多個 worker 可以同時讀取
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, hash BLOB NOT NULL, vector BLOB NOT NULL, "
+                "used_at INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (model, hash)) WITHOUT ROWID"
+            )
+            self._add_used_at(conn)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS embeddings_used_at ON embeddings (used_at)"
+            )
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _add_used_at(conn):
+        """舊版的資料表沒有 used_at，補上欄位並把既有的記錄視為現在使用過"""
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(embeddings)")}
+        if "used_at" in columns:
+            return
+        try:
+            with conn:
+                conn.execute(
+                    "ALTER TABLE embeddings ADD COLUMN used_at INTEGER NOT NULL DEFAULT 0"
+                )
+                conn.execute("UPDATE embeddings SET used_at = ?", (int(time.time()),))
+        except sqlite3.OperationalError:
+            # 其他 worker 已經補上欄位
+            pass
+
+    def get_many(self, model, hashes):
+        """回傳 {hash: float32 向量}，只包含命中的項目"""
+        found = {}
+        if not self.enabled or not hashes:
+            return found
+
+        conn = self._connection()
+        hashes = list(hashes)
+        for start in range(0, len(hashes), _LOOKUP_BATCH):
+            batch = hashes[start : start + _LOOKUP_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            rows = conn.execute(
+                f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                [model, *batch],
+            )
+            for key, vector in rows:
+                found[key] = np.frombuffer(vector, dtype=np.float16).astype(np.float32)
+        self._touch(conn, model, list(found))
+        return found
+
+    @staticmethod
+    def _touch(conn, model, hashes):
+        now = int(time.time())
+        with conn:
+            for start in range(0, len(hashes), _LOOKUP_BATCH):
+                batch = hashes[start : start + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                conn.execute(
+                    f"UPDATE embeddings SET used_at = ? WHERE model = ? "
+                    f"AND hash IN ({placeholders}) AND used_at < ?",
+                    [now, model, *batch, now - _TOUCH_SECONDS],
+                )
+
+    def put_many(self, model, items):
+        """items 為 [(hash, 向量), ...]"""
+        if not self.enabled or not items:
+            return
+        conn = self._connection()
+        now = int(time.time())
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, used_at) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (model, key, np.asarray(vector, dtype=np.float16).tobytes(), now)
+                    for key, vector in items
+                ],
+            )
+        if time.monotonic() - self._last_prune >= self.prune_interval:
+            self.prune()
+
+    def prune(self):
+        """刪除超過 max_age_days 沒有使用的記錄，筆數仍超過 max_entries 時再由最久未使用的開始刪除"""
+        self._last_prune = time.monotonic()
+        conn = self._connection()
+        removed = 0
+        with conn:
+            if self.max_age_days:
+                cutoff = int(time.time()) - int(self.max_age_days * 86400)
+                removed += conn.execute(
+                    "DELETE FROM embeddings WHERE used_at < ?", (cutoff,)
+                ).rowcount
+            if self.max_entries:
+                excess = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+                excess -= self.max_entries
+                if excess > 0:
+                    (threshold,) = conn.execute(
+                        "SELECT used_at FROM embeddings ORDER BY used_at LIMIT 1 OFFSET ?",
+                        (excess - 1,),
+                    ).fetchone()
+                    removed += conn.execute(
+                        "DELETE FROM embeddings WHERE used_at <= ?", (threshold,)
+                    ).rowcount
+        if removed:
+            metrics.incr("embedding_cache.evicted", removed)
+            print(f"嵌入快取已刪除 {removed} 筆記錄")
+        return removed
+
+    def stats(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return {"enabled": self.enabled, "entries": 0, "bytes": 0}
+        conn = self._connection()
+        models = dict(conn.execute("SELECT model, COUNT(*) FROM embeddings GROUP BY model"))
+        return {
+            "enabled": True,
+            "entries": sum(models.values()),
+            "entries_by_model": models,
+            "bytes": sum(
+                os.path.getsize(path)
+                for path in (self.path, f"{self.path}-wal")
+                if os.path.exists(path)
+            ),
+            "max_entries": self.max_entries,
+            "max_age_days": self.max_age_days,
+        }
+
+    def record_encode_time(self, chunks, seconds):
+        if not chunks:
+            return
+        per_chunk = seconds / chunks
+        if self.seconds_per_chunk is None:
+            self.seconds_per_chunk = per_chunk
+        else:
+            self.seconds_per_chunk = 0.8 * self.seconds_per_chunk + 0.2 * per_chunk
+        metrics.gauge("embedding_cache.seconds_per_chunk", self.seconds_per_chunk)
+
+    def estimate_saved(self, hits):
+        return hits * (self.seconds_per_chunk or 0.0)
+
+
+embedding_cache = EmbeddingCache(
+    os.path.join(
+        pathlib.Path(__file__).parent.absolute(), "saved_data", "embedding_cache.sqlite3"
+    )
+)
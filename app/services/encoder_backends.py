@@ -0,0 +1,52 @@
+import os
+
+TORCH = "torch"
+ONNX = "onnx"
+ONNX_INT8 = "onnx-int8"
+BACKENDS = (TORCH, ONNX, ONNX_INT8)
+
+
+def model_id(model_name, backend, quantization="avx2"):
+    """嵌入快取與索引檔使用的模型識別；不同後端、不同量化設定的向量不可混用"""
+    if backend == TORCH:
+        return model_name
+    if backend == ONNX_INT8:
+        return f"{model_name}@{backend}-{quantization}"
+    return f"{model_name}@{backend}"
+
+
+def _local_dir(export_dir, model_name):
+    return os.path.join(export_dir, model_name.replace("/", "__"))
+
+
+def _quantized_file(quantization):
+    return f"onnx/model_qint8_{quantization}.onnx"
+
+
+def load_encoder(model_name, backend=TORCH, export_dir=None, quantization="avx2"):
+    """依後端載入 SentenceTransformer：PyTorch、ONNX Runtime 或 int8 動態量化的 ONNX"""
+    from sentence_transformers import SentenceTransformer
+
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend: {backend}")
+
+    if backend == TORCH:
+        return SentenceTransformer(model_name)
+
+    if backend == ONNX:
+        # 模型庫沒有 ONNX 檔時 sentence-transformers 會自動匯出
+        return SentenceTransformer(model_name, backend="onnx")
+
+    local_dir = _local_dir(export_dir, model_name)
+    file_name = _quantized_file(quantization)
+    if not os.path.exists(os.path.join(local_dir, file_name)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+
+        print(f"匯出 int8 量化的 ONNX 模型: {model_name} ({quantization})")
+        model = SentenceTransformer(model_name, backend="onnx")
+        model.save(local_dir)
+        export_dynamic_quantized_onnx_model(model, quantization, local_dir)
+
+    return SentenceTransformer(
+        local_dir, backend="onnx", model_kwargs={"file_name": file_name}
+    )
@@ -0,0 +1,203 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app
+
+from app.models import (
+    FeedbackJobs,
+    FeedbackJobStudents,
+    Student,
+    StudentAIFeedbacks,
+    StudentAIMessages,
+    db,
+)
+from app.services.background import BackgroundExecutor
+from app.services.llm_gateway import llm_gateway
+from app.services.llm_scheduler import BATCH, CallScope
+from app.services.loader import get_ai_student
+from app.services.metrics import metrics
+
+
+class FeedbackGenerator:
+    """在背景為整個單元的學生產生回饋，限制同時呼叫 LLM 的數量，並逐一記錄每位學生的進度以便中斷後續跑"""
+
+    def __init__(self):
+        self.concurrency = 4
+        self.model_name = "gpt-4"
+        self.max_tokens = 1500
+        self.executor = BackgroundExecutor("feedback", max_workers=2)
+        self._active = set()
+        self._active_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.concurrency = app.config.get("FEEDBACK_CONCURRENCY", self.concurrency)
+        self.model_name = app.config.get("FEEDBACK_MODEL", self.model_name)
+
+    def start(self, course_id, course_section, teacher_id, student_conversation):
+        """建立新的工作；同一單元若有未完成的工作則接續執行"""
+        job = (
+            FeedbackJobs.query.filter_by(course_id=course_id, course_section=course_section)
+            .filter(FeedbackJobs.status.in_(["pending", "running", "failed"]))
+            .order_by(FeedbackJobs.id.desc())
+            .first()
+        )
+
+        if job is None:
+            job = FeedbackJobs(
+                course_id=course_id,
+                course_section=course_section,
+                teacher_id=teacher_id,
+                conversation_id=student_conversation.id,
+                status="pending",
+            )
+            db.session.add(job)
+            db.session.flush()
+
+            students = Student.query.filter_by(course=course_id).all()
+            for student in students:
+                db.session.add(
+                    FeedbackJobStudents(job_id=job.id, student_id=student.id, status="pending")
+                )
+            job.total = len(students)
+            db.session.commit()
+
+        with self._active_lock:
+            if job.id in self._active:
+                return job
+            self._active.add(job.id)
+
+        self.executor.submit(current_app._get_current_object(), self._run, job.id)
+        return job
+
+    def _run(self, job_id):
+        try:
+            job = FeedbackJobs.query.get(job_id)
+            job.status = "running"
+            db.session.commit()
+
+            # 只處理尚未完成的學生，中斷後重新執行時會從這裡接續
+            student_ids = [
+                item.student_id
+                for item in FeedbackJobStudents.query.filter_by(job_id=job_id)
+                .filter(FeedbackJobStudents.status != "done")
+                .all()
+            ]
+            app = current_app._get_current_object()
+
+            def run_one(student_id):
+                with app.app_context():
+                    try:
+                        self._generate_one(job_id, student_id)
+                    finally:
+                        db.session.remove()
+
+            with ThreadPoolExecutor(
+                max_workers=self.concurrency, thread_name_prefix="feedback-student"
+            ) as pool:
+                list(pool.map(run_one, student_ids))
+
+            failed = FeedbackJobStudents.query.filter_by(
+                job_id=job_id, status="failed"
+            ).count()
+            job = FeedbackJobs.query.get(job_id)
+            # 有學生失敗時保留為 failed，再次觸發會只重跑失敗的學生
+            job.status = "failed" if failed else "done"
+            job.finished_at = datetime.now()
+            db.session.commit()
+        finally:
+            with self._active_lock:
+                self._active.discard(job_id)
+
+    def _generate_one(self, job_id, student_id):
+        from langchain.schema import HumanMessage, SystemMessage
+
+        job = FeedbackJobs.query.get(job_id)
+        item = FeedbackJobStudents.query.filter_by(
+            job_id=job_id, student_id=student_id
+        ).first()
+
+        try:
+            feedback = StudentAIFeedbacks.query.filter_by(
+                user_id=student_id, conversation_id=job.conversation_id
+            ).first()
+            latest_message_id = (
+                db.session.query(db.func.max(StudentAIMessages.id))
+                .filter_by(conversation_id=job.conversation_id, student_id=student_id)
+                .scalar()
+            )
+
+            # 上次產生回饋後沒有新的對話，直接略過
+            if feedback is not None and feedback.last_message_id == latest_message_id:
+                item.status = "done"
+                item.error = None
+                db.session.commit()
+                metrics.incr("feedback.students_skipped")
+                return
+
+            # 已有回饋時只送出先前的總結與新增的對話
+            previous = feedback if feedback is not None and feedback.last_message_id else None
+            conversation, conversation_history = get_ai_student().load_conversation_history(
+                job.course_id,
+                job.course_section,
+                student_id,
+                after_id=previous.last_message_id if previous else None,
+                # 之後才送出的訊息不納入這次的回饋，下次會被視為新的對話
+                until_id=latest_message_id or 0,
+            )
+            if not conversation:
+                item.status = "done"
+                db.session.commit()
+                return
+
+            if previous:
+                summary_prompt = f"以下是先前對這位學生學習狀況的總結：\n\n{previous.feedback}\n\n請根據之後新增的對話更新這份總結，保留仍然成立的重點：\n\n"
+            else:
+                summary_prompt = "請總結以下對話的重點，幫助老師了解學生的學習狀況，如果對話是空白的，則回覆\"學生尚未進行對話\"，不要自己改變文字：\n\n"
+            for _, sender, a, _ in conversation_history:
+                if sender == 'user':
+                    summary_prompt += f"學生說: {a} "
+                elif sender == 'assistant':
+                    summary_prompt += f"AI 助教回: {a} \n\n"
+
+            messages = [
+                SystemMessage(content="您是一位 AI 助教，請根據以下對話歷史生成一個詳細的總結，幫助老師了解學生的學習狀況。"),
+                HumanMessage(content=summary_prompt)
+            ]
+
+            with metrics.timer("feedback.student_seconds"):
+                summary = llm_gateway.invoke(
+                    messages,
+                    self.model_name,
+                    self.max_tokens,
+                    CallScope(BATCH, job.course_id, job.teacher_id),
+                )
+            metrics.observe("feedback.new_messages", len(conversation_history))
+
+            if feedback is None:
+                feedback = StudentAIFeedbacks(
+                    user_id=student_id, conversation_id=job.conversation_id, feedback=summary
+                )
+                db.session.add(feedback)
+            else:
+                feedback.feedback = summary
+            feedback.last_message_id = latest_message_id
+
+            item.status = "done"
+            item.error = None
+            db.session.commit()
+            metrics.incr("feedback.students_done")
+
+        except Exception as e:
+            db.session.rollback()
+            print(f"Error generating feedback for student {student_id}: {e}")
+            item = FeedbackJobStudents.query.filter_by(
+                job_id=job_id, student_id=student_id
+            ).first()
+            item.status = "failed"
+            item.error = str(e)[:1000]
+            db.session.commit()
+            metrics.incr("feedback.students_failed")
+
+
+feedback_generator = FeedbackGenerator()
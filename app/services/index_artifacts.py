@@ -0,0 +1,162 @@
+import hashlib
+import os
+import pathlib
+
+import numpy as np
+
+from app.models import TeacherAIFaisses
+from app.services.chunk_store import (
+    ChunkWriter,
+    chunks_path,
+    legacy_sentences_path,
+    load_chunks,
+)
+from app.services.index_cache import index_cache
+from app.services.vector_index import FLOAT32, meta_path, vectors_path
+
+
+class ArtifactWriter:
+    """ingestion 逐批寫入段落、頁碼與原始向量，close() 時才換成正式檔案；整份文件的向量不必同時在記憶體"""
+
+    # 暫存的原始向量轉成 .npy 時每次複製的列數
+    COPY_ROWS = 65536
+
+    def __init__(self, artifacts, name):
+        self.artifacts = artifacts
+        self.name = name
+        self.count = 0
+        self.dimension = None
+        self._pages = []
+        self._chunks = ChunkWriter(chunks_path(artifacts.save_dir, name))
+        self._raw_path = f"{artifacts.vectors_path(name)}.{os.getpid()}.{id(self)}.raw"
+        self._raw = open(self._raw_path, "wb")
+
+    def append(self, chunks, embeddings):
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.dimension = embeddings.shape[1]
+        self._raw.write(embeddings.tobytes())
+        self._pages.extend([c["page"], c.get("page_end", c["page"])] for c in chunks)
+        self._chunks.append([c["text"] for c in chunks])
+        self.count += len(chunks)
+
+    def close(self):
+        """依序寫入 段落 → 頁碼 → 向量；索引檔由呼叫端最後寫入，exists() 為真時其他檔案都已完整"""
+        self._raw.close()
+        try:
+            self._chunks.close()
+            self.artifacts._save_array(
+                self.artifacts.pages_path(self.name), np.array(self._pages, dtype=np.int32)
+            )
+
+            path = self.artifacts.vectors_path(self.name)
+            tmp_path = f"{self._raw_path}.npy"
+            shape = (self.count, self.dimension)
+            raw = np.memmap(self._raw_path, dtype=np.float32, mode="r", shape=shape)
+            vectors = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=np.float32, shape=shape
+            )
+            for start in range(0, self.count, self.COPY_ROWS):
+                vectors[start : start + self.COPY_ROWS] = raw[start : start + self.COPY_ROWS]
+            vectors.flush()
+            del vectors, raw
+            os.replace(tmp_path, path)
+        finally:
+            for leftover in (self._raw_path, f"{self._raw_path}.npy"):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+
+    def abort(self):
+        self._raw.close()
+        self._chunks.abort()
+        if os.path.exists(self._raw_path):
+            os.remove(self._raw_path)
+
+
+class IndexArtifacts:
+    """以內容 checksum + 嵌入模型命名的索引檔；相同內容的 TeacherFiles 共用一份，沒有引用時才刪除"""
+
+    def __init__(self, save_dir):
+        self.save_dir = save_dir
+
+    @staticmethod
+    def name_for(checksum, model_id, chunk_tokens, chunk_overlap, storage=FLOAT32):
+        # 切段設定不同時段落內容也不同，一併納入
+        settings = f"{model_id}|{chunk_tokens}|{chunk_overlap}"
+        if storage != FLOAT32:
+            # float32 沿用原本的名稱，已建立的索引不必重建
+            settings = f"{settings}|{storage}"
+        return f"{checksum}-{hashlib.sha256(settings.encode('utf-8')).hexdigest()[:12]}"
+
+    def index_path(self, name):
+        return os.path.join(self.save_dir, f"{name}_index.faiss")
+
+    def vectors_path(self, name):
+        return vectors_path(self.index_path(name))
+
+    def pages_path(self, name):
+        return os.path.join(self.save_dir, f"{name}_pages.npy")
+
+    def _paths(self, name):
+        index_path = self.index_path(name)
+        return (
+            index_path,
+            meta_path(index_path),
+            chunks_path(self.save_dir, name),
+            legacy_sentences_path(self.save_dir, name),
+            self.vectors_path(name),
+            self.pages_path(name),
+        )
+
+    def exists(self, name):
+        return all(
+            os.path.exists(path)
+            for path in (
+                self.index_path(name),
+                chunks_path(self.save_dir, name),
+                self.vectors_path(name),
+                self.pages_path(name),
+            )
+        )
+
+    @staticmethod
+    def _save_array(path, array):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, path)
+
+    def writer(self, name):
+        os.makedirs(self.save_dir, exist_ok=True)
+        return ArtifactWriter(self, name)
+
+    def load_vectors(self, name):
+        return np.load(self.vectors_path(name), mmap_mode="r")
+
+    def load(self, name):
+        """回傳 (chunks, embeddings)；向量以 mmap 讀取"""
+        texts = load_chunks(self.save_dir, name)
+        pages = np.load(self.pages_path(name))
+        embeddings = self.load_vectors(name)
+        chunks = [
+            {"text": texts[i], "page": int(page), "page_end": int(page_end)}
+            for i, (page, page_end) in enumerate(pages)
+        ]
+        return chunks, embeddings
+
+    @staticmethod
+    def refcount(name, exclude_file_id=None):
+        query = TeacherAIFaisses.query.filter_by(artifact=name)
+        if exclude_file_id is not None:
+            query = query.filter(TeacherAIFaisses.file_id != exclude_file_id)
+        return query.count()
+
+    def delete(self, name):
+        index_cache.invalidate(name)
+        for path in self._paths(name):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+index_artifacts = IndexArtifacts(
+    os.path.join(pathlib.Path(__file__).parent.absolute(), "saved_data")
+)
@@ -0,0 +1,137 @@
+import sys
+import threading
+from collections import OrderedDict
+
+from app.services.metrics import metrics
+
+
+def _estimate_size(index, sentences):
+    """估計一組索引與句子在記憶體中的大小 (bytes)"""
+    size = 0
+    if index is not None:
+        code_size = getattr(index, "code_size", None) or index.d * 4
+        size += index.ntotal * code_size
+        if hasattr(index, "hnsw"):
+            # HNSW 第 0 層的鄰接表
+            size += index.ntotal * index.hnsw.nb_neighbors(0) * 4
+    if getattr(sentences, "mmapped", False):
+        # mmap 的內容在 page cache 中，由各 worker 共用，不計入
+        pass
+    elif sentences is not None:
+        size += sys.getsizeof(sentences)
+        size += sum(sys.getsizeof(s) for s in sentences)
+    return size
+
+
+class _Loading:
+    """同一個鍵正在載入時，其他執行緒等待並共用這次的結果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = (None, None)
+
+
+class IndexCache:
+    """行程內共用的 FAISS 索引快取，以 (索引名稱, checksum) 為鍵，依位元組上限做 LRU 淘汰"""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # key -> (index, sentences, size)
+        self._loading = {}  # key -> _Loading
+        self._lock = threading.RLock()
+
+    def init_app(self, app):
+        self.max_bytes = app.config.get("INDEX_CACHE_MAX_BYTES", self.max_bytes)
+        metrics.register("index_cache", self.stats)
+
+    @staticmethod
+    def make_key(name, checksum=None):
+        return (str(name), checksum)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[1]
+
+    def put(self, key, index, sentences):
+        size = _estimate_size(index, sentences)
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[2]
+
+            # 單一項目超過上限時不快取，避免把其他項目全部擠掉
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (index, sentences, size)
+            self.current_bytes += size
+
+            while self.current_bytes > self.max_bytes and self._entries:
+                _, (_, _, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def get_or_load(self, key, loader):
+        """命中則直接回傳，否則呼叫 loader() 載入後放入快取；同時多個未命中只會載入一次"""
+        index, sentences = self.get(key)
+        if index is not None:
+            return index, sentences
+
+        with self._lock:
+            loading = self._loading.get(key)
+            leader = loading is None
+            if leader:
+                loading = self._loading[key] = _Loading()
+
+        if not leader:
+            loading.done.wait()
+            return loading.result
+
+        try:
+            index, sentences = loader()
+            if index is not None and sentences is not None:
+                self.put(key, index, sentences)
+            loading.result = (index, sentences)
+            return index, sentences
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+            loading.done.set()
+
+    def invalidate(self, name):
+        """索引檔重建或刪除時由 save_faiss_index 與 IndexArtifacts.delete 呼叫"""
+        name = str(name)
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == name]:
+                self.current_bytes -= self._entries.pop(key)[2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+index_cache = IndexCache()
+
@@ -0,0 +1,400 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import current_app
+
+from app.models import Course, IngestionJobs, TeacherAIFaisses, TeacherFiles, db
+from app.services.background import BackgroundExecutor
+from app.services.chunker import TokenChunker
+from app.services.course_index import course_index
+from app.services.embedding import embedding_service
+from app.services.embedding_cache import chunk_hash, embedding_cache
+from app.services.index_artifacts import index_artifacts
+from app.services.loader import get_ai_teacher
+from app.services.metrics import metrics
+from app.services.pdf_pages import page_extractor
+from app.services.vector_index import index_factory
+
+
+class IngestionPipeline:
+    """上傳 PDF 後在背景完成 逐頁提取 → 切段 → 批次嵌入 → 建立索引，記錄 TeacherAIFaisses 並加入課程索引"""
+
+    def __init__(self):
+        self.job_timeout = timedelta(minutes=30)
+        self.executor = BackgroundExecutor("ingestion", max_workers=1)
+        self.chunk_tokens = 120
+        self.chunk_overlap = 20
+        self.embed_batch_size = 128
+        self.recover_on_start = True
+        # 已提交到本行程執行緒池、尚未執行完的工作
+        self._submitted = set()
+        self._submitted_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.job_timeout = timedelta(seconds=app.config.get("INGESTION_JOB_TIMEOUT", 1800))
+        self.executor.max_workers = app.config.get("INGESTION_WORKERS", 1)
+        self.chunk_tokens = app.config.get("CHUNK_MAX_TOKENS", self.chunk_tokens)
+        self.chunk_overlap = app.config.get("CHUNK_OVERLAP_TOKENS", self.chunk_overlap)
+        self.embed_batch_size = app.config.get(
+            "INGESTION_EMBED_BATCH_SIZE", self.embed_batch_size
+        )
+        self.recover_on_start = app.config.get("INGESTION_RECOVER_ON_START", True)
+
+    @staticmethod
+    def storage_for(course_id):
+        """課程可以個別指定向量儲存方式，沒有指定時使用 VECTOR_INDEX_STORAGE"""
+        course = Course.query.get(course_id)
+        return (course and course.vector_storage) or index_factory.storage
+
+    def artifact_name(self, file):
+        return index_artifacts.name_for(
+            file.checksum,
+            embedding_service.model_id,
+            self.chunk_tokens,
+            self.chunk_overlap,
+            self.storage_for(file.course_id),
+        )
+
+    def _link_artifact(self, file):
+        """相同內容已有索引時直接共用，不需要等背景工作"""
+        name = self.artifact_name(file)
+        if TeacherAIFaisses.query.filter_by(file_id=file.id).first() is not None:
+            return True
+        if not index_artifacts.exists(name):
+            return False
+        db.session.add(TeacherAIFaisses(file_id=file.id, artifact=name))
+        metrics.incr("ingestion.artifact_reused")
+        return True
+
+    def enqueue(self, file_id):
+        file = TeacherFiles.query.get(file_id)
+        artifact = None
+        if file is not None:
+            self._link_artifact(file)
+            artifact = self.artifact_name(file)
+
+        # 共用索引時仍需要背景工作把檔案加入課程索引，但不會重新做嵌入
+        job = IngestionJobs(file_id=file_id, artifact=artifact, status="pending")
+        db.session.add(job)
+        db.session.commit()
+
+        self._submit(job.id)
+        metrics.incr("ingestion.enqueued")
+        return job
+
+    def _submit(self, job_id):
+        with self._submitted_lock:
+            self._submitted.add(job_id)
+        self.executor.submit(current_app._get_current_object(), self._run, job_id)
+
+    def _revive(self, job):
+        """工作只在排入它的行程中執行，該行程重新啟動或請求由其他 worker 處理時會被遺留：
+
+        pending 的工作不在本行程的佇列中就重新提交（_run 以原子更新認領，不會重複執行）；
+        running 超過 job_timeout（從開始執行起算）的工作標記失敗並重新排入佇列
+        """
+        if job.status == "pending":
+            with self._submitted_lock:
+                submitted = job.id in self._submitted
+            if not submitted:
+                metrics.incr("ingestion.resubmitted")
+                self._submit(job.id)
+        elif (
+            job.status == "running"
+            and job.started_at is not None
+            and datetime.now() - job.started_at > self.job_timeout
+        ):
+            # 多個 worker 同時發現時只有一個會成功更新並重新排入
+            timed_out = IngestionJobs.query.filter_by(id=job.id, status="running").update(
+                {"status": "failed", "error": "Timed out"}, synchronize_session=False
+            )
+            db.session.commit()
+            db.session.refresh(job)
+            if timed_out:
+                metrics.incr("ingestion.timed_out")
+                return self.enqueue(job.file_id)
+        return job
+
+    def recover(self):
+        """啟動時把上次行程遺留的工作接回來"""
+        try:
+            jobs = IngestionJobs.query.filter(
+                IngestionJobs.status.in_(("pending", "running"))
+            ).all()
+        except Exception as e:
+            # 資料表尚未建立（例如 init_db 之前）
+            db.session.rollback()
+            print(f"無法讀取背景工作: {e}")
+            return []
+        return [self._revive(job) for job in jobs]
+
+    def latest_job(self, file_id):
+        return (
+            IngestionJobs.query.filter_by(file_id=file_id)
+            .order_by(IngestionJobs.id.desc())
+            .first()
+        )
+
+    def ensure_job(self, file_id, rebuild=False):
+        """回傳檔案目前有效的工作；沒有、失敗或卡住的工作會重新排入佇列，
+        rebuild 或已完成但索引紀錄已不存在時，已完成的工作也會重跑"""
+        job = self.latest_job(file_id)
+        if job is None or job.status == "failed":
+            return self.enqueue(file_id)
+        if job.status == "done" and (
+            rebuild or TeacherAIFaisses.query.filter_by(file_id=file_id).first() is None
+        ):
+            return self.enqueue(file_id)
+        return self._revive(job)
+
+    def remove(self, file):
+        """刪除檔案的索引紀錄與工作紀錄（不會 commit），回傳 commit 後交給 remove_index_data 的索引檔清單"""
+        index_names = []
+        for faiss_file in TeacherAIFaisses.query.filter_by(file_id=file.id).all():
+            index_names.append((faiss_file.index_name, faiss_file.artifact is not None))
+            db.session.delete(faiss_file)
+        IngestionJobs.query.filter_by(file_id=file.id).delete()
+        return index_names
+
+    def remove_index_data(self, course_id, file_id, index_names):
+        """刪除已 commit 後才移除課程索引中的向量；共用的索引檔在沒有其他檔案引用時才刪除"""
+        course_index.remove_file(course_id, file_id)
+        for name, shared in index_names:
+            if not shared or not index_artifacts.refcount(name):
+                index_artifacts.delete(name)
+
+    def discard(self, faiss_file):
+        """索引檔無法讀取時呼叫，回傳重新排入佇列的工作
+
+        共用的索引檔都還在時可能只是暫時性的讀取錯誤，不刪除並回傳空串列；
+        確實遺失時刪除所有引用的紀錄與檔案，並把每個引用的檔案重新排入佇列
+        """
+        name = faiss_file.index_name
+        if faiss_file.artifact and index_artifacts.exists(name):
+            metrics.incr("ingestion.read_errors")
+            return []
+
+        if faiss_file.artifact:
+            rows = TeacherAIFaisses.query.filter_by(artifact=name).all()
+        else:
+            rows = [faiss_file]
+        file_ids = [row.file_id for row in rows]
+        for row in rows:
+            db.session.delete(row)
+        index_artifacts.delete(name)
+        db.session.commit()
+        return [self.enqueue(file_id) for file_id in file_ids]
+
+    @staticmethod
+    def _latest_jobs(course_id):
+        """課程中每個檔案最新的工作，以一次查詢取得"""
+        latest_ids = (
+            db.session.query(db.func.max(IngestionJobs.id))
+            .join(TeacherFiles, TeacherFiles.id == IngestionJobs.file_id)
+            .filter(TeacherFiles.course_id == course_id)
+            .group_by(IngestionJobs.file_id)
+        )
+        return {
+            job.file_id: job
+            for job in IngestionJobs.query.filter(IngestionJobs.id.in_(latest_ids))
+        }
+
+    def pending_jobs(self, course_id):
+        jobs = [
+            self._revive(job)
+            for job in self._latest_jobs(course_id).values()
+            if job.status in ("pending", "running")
+        ]
+        return [job for job in jobs if job.status in ("pending", "running")]
+
+    def backfill_course(self, course_id):
+        """把尚未加入課程索引的檔案排入佇列（例如在課程索引上線前上傳的檔案）
+
+        在上傳、變更儲存方式或執行 backfill_course_index.py 時呼叫，不在每次搜尋時呼叫；
+        以目前設定失敗過的檔案（讀不到內容的 PDF 等）不會重試
+        """
+        latest = self._latest_jobs(course_id)
+        jobs = []
+        for file in TeacherFiles.query.filter_by(course_id=course_id).all():
+            if not file.name.lower().endswith(".pdf") or course_index.has_file(
+                course_id, file.id
+            ):
+                continue
+            job = latest.get(file.id)
+            if job is not None and job.status in ("pending", "running"):
+                jobs.append(self._revive(job))
+            elif (
+                job is not None
+                and job.status == "failed"
+                and job.artifact == self.artifact_name(file)
+            ):
+                continue
+            else:
+                jobs.append(self.enqueue(file.id))
+        return jobs
+
+    def _run(self, job_id):
+        try:
+            self._run_claimed(job_id)
+        finally:
+            with self._submitted_lock:
+                self._submitted.discard(job_id)
+
+    def _run_claimed(self, job_id):
+        # 同一個工作可能被多個行程提交，以原子更新認領，只有一個會執行
+        claimed = IngestionJobs.query.filter_by(id=job_id, status="pending").update(
+            {"status": "running", "started_at": datetime.now()}, synchronize_session=False
+        )
+        db.session.commit()
+        if not claimed:
+            return
+        job = IngestionJobs.query.get(job_id)
+
+        try:
+            with metrics.timer("ingestion.seconds"):
+                self._ingest(job.file_id, job)
+            job.status = "done"
+            metrics.incr("ingestion.done")
+        except Exception as e:
+            db.session.rollback()
+            job.status = "failed"
+            job.error = str(e)[:1000]
+            metrics.incr("ingestion.failed")
+        finally:
+            job.finished_at = datetime.now()
+            db.session.commit()
+
+    def is_current(self, faiss_file, file):
+        """索引是否以目前的嵌入模型、切段設定與儲存方式建立"""
+        return faiss_file.artifact == self.artifact_name(file)
+
+    def _ingest(self, file_id, job=None):
+        file = TeacherFiles.query.get(file_id)
+        if file is None:
+            raise ValueError(f"File {file_id} not found")
+
+        self._link_artifact(file)
+        name = self.artifact_name(file)
+        storage = self.storage_for(file.course_id)
+        faiss_file = TeacherAIFaisses.query.filter_by(file_id=file_id).first()
+        if (
+            faiss_file is not None
+            and faiss_file.artifact == name
+            and course_index.has_file(file.course_id, file_id)
+        ):
+            return
+
+        if not index_artifacts.exists(name):
+            self._build_artifact(file, name, storage, job)
+        chunks, embeddings = index_artifacts.load(name)
+
+        if faiss_file is None:
+            db.session.add(TeacherAIFaisses(file_id=file_id, artifact=name))
+            db.session.commit()
+        elif faiss_file.artifact != name:
+            # 舊版以 file_id 命名的索引，或以其他模型/切段設定/儲存方式建立的索引，改指向新的索引檔
+            previous = faiss_file.index_name
+            shared = faiss_file.artifact is not None
+            faiss_file.artifact = name
+            db.session.commit()
+            if not shared or not index_artifacts.refcount(previous):
+                index_artifacts.delete(previous)
+
+        course_index.add_file(file.course_id, file.id, chunks, embeddings, storage)
+
+    def _build_artifact(self, file, name, storage, job=None):
+        """逐批 切段 → 嵌入 → 寫入磁碟，記憶體中只保留一個批次的段落與向量；FAISS 索引由寫好的向量 mmap 建立"""
+        stats = {"hits": 0, "misses": 0, "encode_seconds": 0.0}
+        writer = index_artifacts.writer(name)
+        try:
+            for batch in self._chunk_batches(file):
+                writer.append(batch, self._embed(batch, stats))
+            if not writer.count:
+                raise ValueError("Unable to read file")
+            writer.close()
+        except Exception:
+            writer.abort()
+            raise
+        metrics.observe("ingestion.chunks", writer.count)
+        self._record_embed_stats(stats, job)
+
+        index = index_factory.build(index_artifacts.load_vectors(name), storage=storage)
+        teacher = get_ai_teacher()
+        # 段落已由 writer 寫入，只需保存索引
+        if not teacher.save_faiss_index(index, None, name):
+            raise ValueError("Unable to save faiss index")
+
+    def _chunk_batches(self, file):
+        """逐頁讀取 PDF 並切成有 token 上限的段落，每 embed_batch_size 個段落產出一批"""
+        # 段落不能超過嵌入模型的輸入長度，否則尾端會被截掉
+        max_tokens = min(self.chunk_tokens, embedding_service.max_seq_length - 2)
+        chunker = TokenChunker(
+            embedding_service.count_tokens,
+            max_tokens=max_tokens,
+            overlap_tokens=min(self.chunk_overlap, max_tokens // 2),
+        )
+        batch = []
+        for chunk in chunker.chunks(page_extractor.iter_pages(file.path)):
+            batch.append(chunk)
+            if len(batch) >= self.embed_batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _embed(self, chunks, stats):
+        """只為快取中沒有的段落產生嵌入向量，命中/運算時間累加到 stats"""
+        model = embedding_service.model_id
+        hashes = [chunk_hash(c["text"]) for c in chunks]
+        cached = embedding_cache.get_many(model, set(hashes))
+        missing = [i for i, key in enumerate(hashes) if key not in cached]
+
+        vectors = None
+        if missing:
+            began = time.perf_counter()
+            vectors = embedding_service.encode(
+                [chunks[i]["text"] for i in missing], batch_size=self.embed_batch_size
+            )
+            stats["encode_seconds"] += time.perf_counter() - began
+            # 與快取相同精度，同一段落不論是否命中都得到相同的向量
+            vectors = np.asarray(vectors, dtype=np.float16).astype(np.float32)
+            embedding_cache.put_many(
+                model, [(hashes[i], vectors[j]) for j, i in enumerate(missing)]
+            )
+
+        if vectors is not None:
+            dimension = vectors.shape[1]
+        else:
+            dimension = next(iter(cached.values())).shape[0]
+        embeddings = np.empty((len(chunks), dimension), dtype=np.float32)
+        for i, key in enumerate(hashes):
+            if key in cached:
+                embeddings[i] = cached[key]
+        if missing:
+            embeddings[missing] = vectors
+
+        stats["hits"] += len(chunks) - len(missing)
+        stats["misses"] += len(missing)
+        return embeddings
+
+    @staticmethod
+    def _record_embed_stats(stats, job=None):
+        hits, misses, encode_seconds = stats["hits"], stats["misses"], stats["encode_seconds"]
+        embedding_cache.record_encode_time(misses, encode_seconds)
+        saved = embedding_cache.estimate_saved(hits)
+        metrics.observe("ingestion.embed_seconds", encode_seconds)
+        metrics.incr("embedding_cache.hits", hits)
+        metrics.incr("embedding_cache.misses", misses)
+        if job is not None:
+            job.cache_hits = hits
+            job.cache_misses = misses
+            job.encode_seconds = encode_seconds
+            job.encode_seconds_saved = saved
+        print(
+            f"嵌入快取命中 {hits}/{hits + misses}，嵌入 {encode_seconds:.2f}s，估計省下 {saved:.2f}s"
+        )
+
+
+ingestion = IngestionPipeline()
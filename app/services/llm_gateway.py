@@ -0,0 +1,236 @@
+import random
+import threading
+import time
+
+from app.services.llm_scheduler import DEFAULT_SCOPE, llm_scheduler
+from app.services.memory import count_tokens
+from app.services.metrics import metrics
+
+
+class CircuitOpenError(Exception):
+    """LLM 服務異常期間直接拒絕請求"""
+
+
+class CircuitBreaker:
+    """連續失敗達門檻後開路，冷卻時間過後放行一個試探請求"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    metrics.incr("llm.circuit_opened")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+def _estimate_tokens(messages):
+    """估算 prompt 的 token 數，用於供應商的每分鐘 token 額度"""
+    return sum(count_tokens(str(message.content)) for message in messages)
+
+
+def _is_retryable(error):
+    """429、5xx、逾時與連線錯誤才重試"""
+    import openai
+
+    if isinstance(
+        error,
+        (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError),
+    ):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code >= 500
+    return False
+
+
+class LLMGateway:
+    """所有 LLM 呼叫的共用入口：連線池、逾時、指數退避重試、斷路器與指標"""
+
+    def __init__(self):
+        self.api_key = None
+        self.timeout = 60
+        self.max_retries = 3
+        self.backoff_base = 0.5
+        self.backoff_max = 8.0
+        self.pool_size = 50
+        self.breaker = CircuitBreaker()
+        self._clients = {}
+        self._http_client = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.api_key = app.config.get("OPENAI_API_KEY")
+        self.timeout = app.config.get("LLM_TIMEOUT", self.timeout)
+        self.max_retries = app.config.get("LLM_MAX_RETRIES", self.max_retries)
+        self.pool_size = app.config.get("LLM_POOL_SIZE", self.pool_size)
+        self.breaker = CircuitBreaker(
+            app.config.get("LLM_BREAKER_THRESHOLD", 5),
+            app.config.get("LLM_BREAKER_RESET", 30),
+        )
+        metrics.register("llm_gateway", self.stats)
+
+    def _limits(self):
+        import httpx
+
+        return httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+        )
+
+    def _chat_model(self, model, max_tokens, http_client):
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
+            api_key=self.api_key,
+            model_name=model,
+            max_tokens=max_tokens,
+            timeout=self.timeout,
+            # 重試由 gateway 處理
+            max_retries=0,
+            stream_usage=True,
+            http_client=http_client,
+        )
+
+    def client(self, model="gpt-4o", max_tokens=4096):
+        """同一組 (model, max_tokens) 共用一個 client，所有 client 共用 HTTP 連線池"""
+        key = (model, max_tokens)
+        client = self._clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(key)
+                if client is None:
+                    import httpx
+
+                    if self._http_client is None:
+                        self._http_client = httpx.Client(
+                            limits=self._limits(), timeout=self.timeout
+                        )
+                    client = self._chat_model(model, max_tokens, self._http_client)
+                    self._clients[key] = client
+        return client
+
+    def _backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2**attempt))
+        return random.uniform(0, delay)
+
+    def _check_breaker(self, model):
+        if not self.breaker.allow():
+            metrics.incr("llm.rejected")
+            raise CircuitOpenError(f"LLM provider is degraded, failing fast ({model})")
+
+    def _record(self, model, start, response):
+        metrics.observe(f"llm.latency_seconds.{model}", time.perf_counter() - start)
+        usage = getattr(response, "usage_metadata", None) or {}
+        metrics.incr("llm.input_tokens", usage.get("input_tokens", 0))
+        metrics.incr("llm.output_tokens", usage.get("output_tokens", 0))
+        metrics.incr("llm.calls")
+        self.breaker.record_success()
+
+    def _record_error(self, model, error):
+        metrics.incr(f"llm.errors.{type(error).__name__}")
+        if _is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            # 400、401 等錯誤代表供應商有正常回應，對斷路器而言視為成功，也結束 half_open 的試探請求
+            self.breaker.record_success()
+
+    def invoke(self, messages, model="gpt-4o", max_tokens=4096, scope=DEFAULT_SCOPE):
+        """回傳回應文字，失敗時丟出例外"""
+        client = self.client(model, max_tokens)
+        cost = _estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            self._check_breaker(model)
+            recorded = False
+            try:
+                with llm_scheduler.slot(scope, cost):
+                    start = time.perf_counter()
+                    response = client.invoke(messages)
+            except Exception as e:
+                recorded = True
+                self._record_error(model, e)
+                if attempt < self.max_retries and _is_retryable(e):
+                    metrics.incr("llm.retries")
+                    time.sleep(self._backoff(attempt))
+                    continue
+                raise
+            else:
+                recorded = True
+                self._record(model, start, response)
+                return response.content.strip()
+            finally:
+                if not recorded:
+                    # 被中斷時（KeyboardInterrupt 等）仍要結束試探請求，否則斷路器會一直停在 half_open
+                    self.breaker.record_success()
+
+    def stream(self, messages, model="gpt-4o", max_tokens=4096, scope=DEFAULT_SCOPE):
+        """逐段產生回應文字；只有在尚未送出任何內容前才會重試"""
+        client = self.client(model, max_tokens)
+        cost = _estimate_tokens(messages)
+        for attempt in range(self.max_retries + 1):
+            self._check_breaker(model)
+            started = False
+            recorded = False
+            response = None
+            try:
+                with llm_scheduler.slot(scope, cost):
+                    start = time.perf_counter()
+                    for chunk in client.stream(messages):
+                        response = chunk if response is None else response + chunk
+                        if chunk.content:
+                            started = True
+                            yield chunk.content
+            except Exception as e:
+                recorded = True
+                self._record_error(model, e)
+                if not started and attempt < self.max_retries and _is_retryable(e):
+                    metrics.incr("llm.retries")
+                    time.sleep(self._backoff(attempt))
+                    continue
+                raise
+            else:
+                recorded = True
+                self._record(model, start, response)
+                return
+            finally:
+                if not recorded:
+                    # SSE 用戶端中途斷線時產生器收到 GeneratorExit，供應商本身沒有問題，
+                    # 仍要結束試探請求，否則斷路器會一直停在 half_open
+                    self.breaker.record_success()
+
+    def stats(self):
+        return {
+            "circuit_state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "clients": len(self._clients),
+        }
+
+
+llm_gateway = LLMGateway()
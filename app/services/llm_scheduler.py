@@ -0,0 +1,223 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from itertools import count
+
+from app.services.metrics import metrics
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+# 數字越小越優先
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+
+@dataclass(frozen=True)
+class CallScope:
+    """LLM 呼叫的排程資訊：優先等級與所屬的課程/教師"""
+
+    priority: str = INTERACTIVE
+    course_id: int = None
+    teacher_id: int = None
+
+
+DEFAULT_SCOPE = CallScope()
+
+
+class TokenBucket:
+    """以固定速率補充的 token bucket，rate 為每秒補充量"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_take(self, amount):
+        if self.rate <= 0:
+            return True
+        self._refill()
+        # 單次需求超過容量時只要求 bucket 是滿的，避免永遠等不到
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return True
+        return False
+
+    def wait_time(self, amount):
+        if self.rate <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class _Ticket:
+    __slots__ = ("order", "scope", "cost", "enqueued_at", "granted")
+
+    def __init__(self, order, scope, cost):
+        self.order = order
+        self.scope = scope
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+    def __lt__(self, other):
+        return self.order < other.order
+
+
+class LLMScheduler:
+    """程序內的 LLM 請求排程：互動請求優先於批次工作，並限制整體、每門課與每位教師的同時呼叫數與供應商額度"""
+
+    def __init__(self):
+        self.max_concurrency = 16
+        self.batch_max_concurrency = 8
+        self.course_max_concurrency = 8
+        self.teacher_max_concurrency = 8
+        self.requests = TokenBucket(0, 1)
+        self.tokens = TokenBucket(0, 1)
+        self._waiting = []
+        self._seq = count()
+        self._running = 0
+        self._running_by_class = {name: 0 for name in PRIORITIES}
+        self._running_by_course = {}
+        self._running_by_teacher = {}
+        self._cond = threading.Condition()
+
+    def init_app(self, app):
+        self.max_concurrency = app.config.get("LLM_MAX_CONCURRENCY", self.max_concurrency)
+        self.batch_max_concurrency = app.config.get(
+            "LLM_BATCH_MAX_CONCURRENCY", self.batch_max_concurrency
+        )
+        self.course_max_concurrency = app.config.get(
+            "LLM_COURSE_MAX_CONCURRENCY", self.course_max_concurrency
+        )
+        self.teacher_max_concurrency = app.config.get(
+            "LLM_TEACHER_MAX_CONCURRENCY", self.teacher_max_concurrency
+        )
+        # 供應商額度以每分鐘計，0 代表不限制
+        rpm = app.config.get("LLM_REQUESTS_PER_MINUTE", 0)
+        tpm = app.config.get("LLM_TOKENS_PER_MINUTE", 0)
+        self.requests = TokenBucket(rpm / 60, max(rpm / 6, 1))
+        self.tokens = TokenBucket(tpm / 60, max(tpm / 6, 1))
+        metrics.register("llm_scheduler", self.stats)
+
+    def _admissible(self, ticket):
+        scope = ticket.scope
+        if self._running >= self.max_concurrency:
+            return False
+        # 批次工作不能佔滿所有名額，保留給互動請求
+        if scope.priority == BATCH and self._running_by_class[BATCH] >= self.batch_max_concurrency:
+            return False
+        if (
+            scope.course_id is not None
+            and self._running_by_course.get(scope.course_id, 0) >= self.course_max_concurrency
+        ):
+            return False
+        if (
+            scope.teacher_id is not None
+            and self._running_by_teacher.get(scope.teacher_id, 0) >= self.teacher_max_concurrency
+        ):
+            return False
+        return True
+
+    def _dispatch(self):
+        """依優先順序放行可執行的請求，回傳下一次需要重新檢查的秒數（額度不足時）"""
+        retry_after = None
+        for ticket in sorted(self._waiting):
+            if not self._admissible(ticket):
+                continue
+            wait = max(self.requests.wait_time(1), self.tokens.wait_time(ticket.cost))
+            if wait > 0:
+                # 額度不足時不讓後面的請求插隊
+                retry_after = wait
+                break
+            self.requests.try_take(1)
+            self.tokens.try_take(ticket.cost)
+            self._waiting.remove(ticket)
+            self._grant(ticket)
+        return retry_after
+
+    def _grant(self, ticket):
+        scope = ticket.scope
+        ticket.granted = True
+        self._running += 1
+        self._running_by_class[scope.priority] += 1
+        if scope.course_id is not None:
+            self._running_by_course[scope.course_id] = (
+                self._running_by_course.get(scope.course_id, 0) + 1
+            )
+        if scope.teacher_id is not None:
+            self._running_by_teacher[scope.teacher_id] = (
+                self._running_by_teacher.get(scope.teacher_id, 0) + 1
+            )
+        metrics.observe(
+            f"llm_scheduler.queue_wait_seconds.{scope.priority}",
+            time.monotonic() - ticket.enqueued_at,
+        )
+        self._cond.notify_all()
+
+    def _decrement(self, counter, key):
+        if key is None:
+            return
+        counter[key] -= 1
+        if counter[key] <= 0:
+            del counter[key]
+
+    def _enqueue(self, scope, cost):
+        if scope.priority not in PRIORITIES:
+            raise ValueError(f"Unknown LLM priority: {scope.priority}")
+        ticket = _Ticket((PRIORITIES[scope.priority], next(self._seq)), scope, cost)
+        self._waiting.append(ticket)
+        return ticket
+
+    def acquire(self, scope=DEFAULT_SCOPE, cost=0):
+        with self._cond:
+            ticket = self._enqueue(scope, cost)
+            while not ticket.granted:
+                retry_after = self._dispatch()
+                if not ticket.granted:
+                    self._cond.wait(timeout=retry_after)
+        return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            if not ticket.granted:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                return
+            ticket.granted = False
+            scope = ticket.scope
+            self._running -= 1
+            self._running_by_class[scope.priority] -= 1
+            self._decrement(self._running_by_course, scope.course_id)
+            self._decrement(self._running_by_teacher, scope.teacher_id)
+            self._dispatch()
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, scope=DEFAULT_SCOPE, cost=0):
+        ticket = self.acquire(scope, cost)
+        try:
+            yield
+        finally:
+            self.release(ticket)
+
+    def stats(self):
+        with self._cond:
+            waiting = {name: 0 for name in PRIORITIES}
+            for ticket in self._waiting:
+                waiting[ticket.scope.priority] += 1
+            return {
+                "running": dict(self._running_by_class),
+                "waiting": waiting,
+            }
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,45 @@
+import threading
+
+from flask import current_app
+
+from app.services.embedding import embedding_service
+
+# 重量級的 AI 套件（torch、sentence-transformers、faiss、langchain）只在第一次使用時才載入
+_services = {}
+_lock = threading.Lock()
+
+
+def _get(name, factory):
+    service = _services.get(name)
+    if service is None:
+        with _lock:
+            service = _services.get(name)
+            if service is None:
+                service = factory()
+                _services[name] = service
+    return service
+
+
+def get_ai_teacher():
+    def factory():
+        from app.services.ai_teacher import AITeacher
+
+        return AITeacher(current_app.config["OPENAI_API_KEY"])
+
+    return _get("teacher", factory)
+
+
+def get_ai_student():
+    def factory():
+        from app.services.ai_student import AIStudent
+
+        return AIStudent(current_app.config["OPENAI_API_KEY"])
+
+    return _get("student", factory)
+
+
+def preload():
+    """供專門處理 AI 請求的 worker 在啟動時預先載入模型"""
+    get_ai_teacher()
+    get_ai_student()
+    embedding_service.model
@@ -0,0 +1,123 @@
+import threading
+from collections import namedtuple
+
+from app.services.metrics import metrics
+
+Turn = namedtuple("Turn", ["last_id", "question", "answer"])
+
+# 每則訊息在 chat 格式中額外的 token 開銷
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_encoding = None
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        with _encoding_lock:
+            if _encoding is None:
+                try:
+                    import tiktoken
+
+                    _encoding = tiktoken.get_encoding("o200k_base")
+                except Exception as e:
+                    print(f"無法載入 tiktoken，改用字元數估算 token: {e}")
+                    _encoding = False
+    return _encoding
+
+
+def count_tokens(text):
+    encoding = _get_encoding()
+    if not encoding:
+        # 中文約一字一 token，英文約四字元一 token，取折衷估算
+        return len(text) // 2 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def pair_turns(history):
+    """把 (id, sender, message, sent_at) 訊息列表配對成 (last_id, question, answer) 的回合"""
+    turns = []
+    question = None
+    for msg_id, sender, message, _ in history:
+        if sender == "user":
+            question = message
+        elif sender == "assistant" and question is not None:
+            turns.append(Turn(msg_id, question, message))
+            question = None
+    return turns
+
+
+class ConversationMemory:
+    """以 token 預算管理對話記憶：最近的回合原文保留，較舊的回合併入滾動摘要"""
+
+    def __init__(self, token_budget, generate, keep_ratio=0.5):
+        self.token_budget = token_budget
+        # generate(messages) -> str，失敗時需丟出例外
+        self.generate = generate
+        # 超出預算時一次縮減到 budget * keep_ratio，避免每一輪都要重新摘要
+        self.keep_ratio = keep_ratio
+
+    @staticmethod
+    def turn_tokens(turn):
+        return (
+            count_tokens(turn.question)
+            + count_tokens(turn.answer)
+            + 2 * MESSAGE_OVERHEAD_TOKENS
+        )
+
+    def _select_recent(self, turns, budget):
+        used = 0
+        kept = 0
+        for turn in reversed(turns):
+            cost = self.turn_tokens(turn)
+            if used + cost > budget:
+                break
+            used += cost
+            kept += 1
+        return kept, used
+
+    def build(self, summary, summarized_until, history):
+        """回傳 (summary, summarized_until, recent_turns)；summarized_until 改變代表摘要已更新需保存"""
+        turns = [
+            turn for turn in pair_turns(history) if turn.last_id > (summarized_until or 0)
+        ]
+
+        kept, used = self._select_recent(turns, self.token_budget)
+        if kept < len(turns):
+            reduced, reduced_used = self._select_recent(
+                turns, self.token_budget * self.keep_ratio
+            )
+            evicted = turns[: len(turns) - reduced]
+            try:
+                summary = self.fold(summary, evicted)
+                summarized_until = evicted[-1].last_id
+                kept, used = reduced, reduced_used
+                metrics.incr("memory.folds")
+                metrics.observe("memory.folded_turns", len(evicted))
+            except Exception as e:
+                # 摘要失敗時不推進水位，這一輪只送出預算內的回合，下次再重試
+                print(f"Error folding conversation memory: {e}")
+                metrics.incr("memory.fold_errors")
+
+        metrics.observe("memory.history_tokens", used)
+        return summary, summarized_until, turns[len(turns) - kept :]
+
+    def fold(self, summary, turns):
+        """把先前的摘要與被移出的回合合併成新的摘要"""
+        from langchain.schema import HumanMessage, SystemMessage
+
+        content = ""
+        if summary:
+            content += f"目前的摘要：\n{summary}\n\n"
+        content += "需要併入摘要的新對話：\n"
+        for turn in turns:
+            content += f"使用者: {turn.question}\nAI: {turn.answer}\n\n"
+
+        messages = [
+            SystemMessage(
+                content="請將目前的摘要與新的對話合併成一段精簡的摘要，保留重要的事實、結論與尚未解決的問題，不超過 300 字"
+            ),
+            HumanMessage(content=content),
+        ]
+        return self.generate(messages)
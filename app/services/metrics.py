@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+
+class Metrics:
+    """行程內的簡易指標收集：計數器、即時值與延遲分佈"""
+
+    def __init__(self, window=2048):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(int)
+        self._gauges = {}
+        self._samples = defaultdict(lambda: deque(maxlen=window))
+        self._totals = defaultdict(lambda: [0, 0.0])  # name -> [count, sum]
+        self._providers = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] += value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            self._samples[name].append(value)
+            total = self._totals[name]
+            total[0] += 1
+            total[1] += value
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def register(self, name, provider):
+        """註冊一個回傳 dict 的函式，於 snapshot 時一併輸出"""
+        with self._lock:
+            self._providers[name] = provider
+
+    @staticmethod
+    def _percentile(values, q):
+        if not values:
+            return None
+        values = sorted(values)
+        k = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+        return values[k]
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+            samples = {name: list(values) for name, values in self._samples.items()}
+            totals = {name: tuple(total) for name, total in self._totals.items()}
+            providers = dict(self._providers)
+
+        distributions = {}
+        for name, values in samples.items():
+            count, total = totals[name]
+            distributions[name] = {
+                "count": count,
+                "mean": total / count if count else None,
+                "p50": self._percentile(values, 0.50),
+                "p99": self._percentile(values, 0.99),
+                "max": max(values) if values else None,
+            }
+
+        result = {
+            "counters": counters,
+            "gauges": gauges,
+            "distributions": distributions,
+        }
+        for name, provider in providers.items():
+            try:
+                result[name] = provider()
+            except Exception as e:
+                result[name] = {"error": str(e)}
+        return result
+
+
+metrics = Metrics()
@@ -0,0 +1,91 @@
+import multiprocessing
+import os
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app.services.metrics import metrics
+from pdf_extract import extract_range
+
+
+class PageExtractor:
+    """逐頁產生 PDF 文字；大型檔案以多個行程平行提取，同時只保留有限數量的頁面在記憶體中
+
+    子行程只在有檔案正在提取時存在，最後一個提取結束後關閉
+    """
+
+    def __init__(self):
+        self.workers = min(os.cpu_count() or 1, 4)
+        self.pages_per_task = 8
+        # 頁數少於此值時直接在目前行程提取，省下行程間傳遞的成本
+        self.parallel_min_pages = 32
+        self._pool = None
+        self._active = 0
+        self._pool_lock = threading.Lock()
+
+    def init_app(self, app):
+        self.workers = app.config.get("PDF_EXTRACT_WORKERS", self.workers)
+        self.pages_per_task = app.config.get("PDF_PAGES_PER_TASK", self.pages_per_task)
+
+    def _acquire_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                # 服務行程有多個執行緒，使用 spawn 避免 fork 複製到持有中的鎖
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            self._active += 1
+            return self._pool
+
+    def _release_pool(self):
+        with self._pool_lock:
+            self._active -= 1
+            if self._active == 0 and self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    @staticmethod
+    def page_count(pdf_path):
+        import fitz  # PyMuPDF
+
+        with fitz.open(pdf_path) as doc:
+            return doc.page_count
+
+    def iter_pages(self, pdf_path):
+        """依頁碼順序產生 (page_no, text)"""
+        pdf_path = os.path.abspath(pdf_path)
+        total = self.page_count(pdf_path)
+        metrics.observe("pdf.pages", total)
+
+        if self.workers <= 1 or total < self.parallel_min_pages:
+            for start in range(0, total, self.pages_per_task):
+                yield from extract_range(pdf_path, start, start + self.pages_per_task)
+            return
+
+        pool = self._acquire_pool()
+        starts = iter(range(0, total, self.pages_per_task))
+        in_flight = deque()
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None:
+                in_flight.append(
+                    pool.submit(extract_range, pdf_path, start, start + self.pages_per_task)
+                )
+
+        # 預先送出的工作數量有上限，頁面被取用後才送出下一批，記憶體用量不隨頁數增加
+        for _ in range(self.workers * 2):
+            submit_next()
+        try:
+            while in_flight:
+                pages = in_flight.popleft().result()
+                submit_next()
+                yield from pages
+        finally:
+            for future in in_flight:
+                future.cancel()
+            self._release_pool()
+
+
+page_extractor = PageExtractor()
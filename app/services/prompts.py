@@ -0,0 +1,88 @@
+import functools
+from dataclasses import dataclass
+
+TEACHER_RAG_SYSTEM_PROMPT = """您是一位AI教學助手。
+請基於上述內容來回答問題。如果需要引入新的例子或故事，請確保與原始課程內容保持關聯。"""
+
+STUDENT_SYSTEM_PROMPT = "您是一位AI教學助手，以下是先前教師和AI助手的對話紀錄，你需要根據這些對話紀錄，回應學生，記住，不要提到「以前的對話紀錄」，改為「根據老師」。現在開始我是學生。"
+
+
+@dataclass(frozen=True)
+class ChatPrompt:
+    """單一請求的提示內容，建立後不可修改，不會與其他請求共用狀態"""
+
+    system: str
+    user_input: str
+    context: str = ""
+    summary: str = ""
+    history: tuple = ()  # ((question, answer), ...)
+    knowledge: tuple = ()  # 教師問答 ((question, answer), ...)，只用於學生端
+
+
+@functools.lru_cache(maxsize=None)
+def _teacher_template():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "{system}"),
+            ("system", "相關上下文：\n\n{context}"),
+            MessagesPlaceholder("summary", optional=True),
+            MessagesPlaceholder("history", optional=True),
+            ("human", "{user_input}"),
+        ]
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _student_template():
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+
+    return ChatPromptTemplate.from_messages(
+        [
+            ("system", "{system}"),
+            MessagesPlaceholder("knowledge", optional=True),
+            ("human", "以上是教師的對話紀錄"),
+            MessagesPlaceholder("summary", optional=True),
+            MessagesPlaceholder("history", optional=True),
+            ("human", "{user_input}"),
+        ]
+    )
+
+
+def _pairs_to_messages(pairs):
+    from langchain.schema import AIMessage, HumanMessage
+
+    messages = []
+    for question, answer in pairs:
+        messages.append(HumanMessage(content=question))
+        messages.append(AIMessage(content=answer))
+    return messages
+
+
+def _summary_messages(title, summary):
+    from langchain.schema import SystemMessage
+
+    if not summary:
+        return []
+    return [SystemMessage(content=f"{title}：\n\n{summary}")]
+
+
+def build_teacher_messages(prompt):
+    return _teacher_template().format_messages(
+        system=prompt.system,
+        context=prompt.context,
+        summary=_summary_messages("先前對話摘要", prompt.summary),
+        history=_pairs_to_messages(prompt.history),
+        user_input=prompt.user_input,
+    )
+
+
+def build_student_messages(prompt):
+    return _student_template().format_messages(
+        system=prompt.system,
+        knowledge=_pairs_to_messages(prompt.knowledge),
+        summary=_summary_messages("與這位學生先前對話的摘要", prompt.summary),
+        history=_pairs_to_messages(prompt.history),
+        user_input=prompt.user_input,
+    )
@@ -0,0 +1,280 @@
+import json
+import threading
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy.orm import undefer
+
+from app.models import (
+    SectionKnowledgePairs,
+    StudentAIConversations,
+    TeacherAIConversations,
+    TeacherAIMessages,
+    db,
+)
+from app.services.ai_teacher import AITeacher
+from app.services.embedding import embedding_service
+from app.services.metrics import metrics
+
+
+def build_snapshot(course_id, course_section):
+    """把某個課程單元中教師與 AI 的對話整理成 [{"q": ..., "a": ...}] 的問答清單"""
+    messages = (
+        db.session.query(
+            TeacherAIMessages.conversation_id,
+            TeacherAIMessages.sender,
+            TeacherAIMessages.message,
+        )
+        .join(
+            TeacherAIConversations,
+            TeacherAIMessages.conversation_id == TeacherAIConversations.id,
+        )
+        .filter(
+            TeacherAIConversations.course_id == course_id,
+            TeacherAIConversations.course_section == course_section,
+        )
+        .order_by(
+            TeacherAIMessages.conversation_id,
+            TeacherAIMessages.sent_at,
+            TeacherAIMessages.id,
+        )
+        .all()
+    )
+
+    pairs = []
+    question = None
+    current_conversation = None
+    for conversation_id, sender, message in messages:
+        if conversation_id != current_conversation:
+            current_conversation = conversation_id
+            question = None
+        if sender == "user":
+            question = message
+        elif sender == "assistant" and question is not None:
+            # LLM 失敗時的錯誤訊息不是教師的知識
+            if AITeacher.FALLBACK_ANSWER not in message:
+                pairs.append({"q": question, "a": message})
+            question = None
+    return pairs
+
+
+def _pair_text(pair):
+    return f"問：{pair['q']}\n答：{pair['a']}"
+
+
+def _embed_pairs(pairs):
+    import faiss
+
+    embeddings = np.asarray(
+        embedding_service.encode([_pair_text(pair) for pair in pairs]),
+        dtype=np.float32,
+    )
+    faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+class _SectionEntry:
+    """單一課程單元的問答與向量索引"""
+
+    def __init__(self, version, deployed_at, rows):
+        self.version = 0
+        self.deployed_at = deployed_at
+        self.pairs = []
+        self.last_id = 0  # 已載入的最後一筆 SectionKnowledgePairs.id
+        self.index = None
+        self.lock = threading.Lock()
+        self.sync(rows, version)
+
+    def sync(self, rows, version):
+        """rows 為依 id 排序的 [(id, {"q", "a"}), ...]，只嵌入比 last_id 新的問答"""
+        import faiss
+
+        with self.lock:
+            rows = [(pair_id, pair) for pair_id, pair in rows if pair_id > self.last_id]
+            if rows:
+                new_pairs = [pair for _, pair in rows]
+                embeddings = _embed_pairs(new_pairs)
+                if self.index is None:
+                    self.index = faiss.IndexFlatIP(embeddings.shape[1])
+                self.index.add(embeddings)
+                self.pairs.extend(new_pairs)
+                self.last_id = rows[-1][0]
+            self.version = max(self.version, version)
+
+    def search(self, query_embedding, top_k):
+        with self.lock:
+            if self.index is None or self.index.ntotal == 0:
+                return []
+            _, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
+            return [self.pairs[i] for i in indices[0] if i >= 0]
+
+
+def _pair_rows(conversation_id, after_id=0):
+    rows = (
+        db.session.query(
+            SectionKnowledgePairs.id,
+            SectionKnowledgePairs.question,
+            SectionKnowledgePairs.answer,
+        )
+        .filter(
+            SectionKnowledgePairs.conversation_id == conversation_id,
+            SectionKnowledgePairs.id > after_id,
+        )
+        .order_by(SectionKnowledgePairs.id)
+        .all()
+    )
+    return [(pair_id, {"q": question, "a": answer}) for pair_id, question, answer in rows]
+
+
+class SectionKnowledge:
+    """部署時預先編譯好的單元知識快照，並為每個單元建立問答向量索引供學生對話檢索"""
+
+    def __init__(self):
+        self._cache = {}  # (course_id, course_section) -> _SectionEntry
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(student_conversation):
+        return (student_conversation.course_id, student_conversation.course_section)
+
+    def deploy(self, student_conversation):
+        """重新編譯快照，取代 SectionKnowledgePairs 中這個單元的所有問答"""
+        # 鎖住單元列，與 add_exchange 互斥
+        student_conversation = (
+            StudentAIConversations.query.filter_by(id=student_conversation.id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+        pairs = build_snapshot(
+            student_conversation.course_id, student_conversation.course_section
+        )
+        SectionKnowledgePairs.query.filter_by(
+            conversation_id=student_conversation.id
+        ).delete()
+        records = [
+            SectionKnowledgePairs(
+                conversation_id=student_conversation.id, question=pair["q"], answer=pair["a"]
+            )
+            for pair in pairs
+        ]
+        db.session.add_all(records)
+        student_conversation.knowledge = None
+        student_conversation.knowledge_version = (student_conversation.knowledge_version or 0) + 1
+        student_conversation.deployed_at = datetime.now()
+        db.session.flush()
+        # commit 後物件會過期，先取出 id，避免建立索引時逐筆重新查詢
+        rows = [(record.id, record.to_pair()) for record in records]
+        version = student_conversation.knowledge_version
+        deployed_at = student_conversation.deployed_at
+        db.session.commit()
+
+        entry = _SectionEntry(version, deployed_at, rows)
+        with self._lock:
+            self._cache[self._key(student_conversation)] = entry
+        return entry
+
+    def _load(self, student_conversation):
+        key = self._key(student_conversation)
+        version = student_conversation.knowledge_version
+
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is not None and entry.version == version:
+            metrics.incr("section_knowledge.hits")
+            return entry
+
+        metrics.incr("section_knowledge.misses")
+        # 舊的部署沒有快照，第一次讀取時補建
+        if student_conversation.deployed_at is None:
+            return self.deploy(student_conversation)
+
+        if entry is None or entry.deployed_at != student_conversation.deployed_at:
+            self._migrate_legacy(student_conversation)
+
+        if entry is not None and entry.deployed_at == student_conversation.deployed_at:
+            # 同一次部署後只新增了問答：沿用既有索引，只讀取並嵌入新的部分
+            entry.sync(_pair_rows(student_conversation.id, entry.last_id), version)
+        else:
+            entry = _SectionEntry(
+                version, student_conversation.deployed_at, _pair_rows(student_conversation.id)
+            )
+
+        with self._lock:
+            self._cache[key] = entry
+        return entry
+
+    @staticmethod
+    def _migrate_legacy(student_conversation):
+        """把舊版 knowledge 欄位的 JSON 快照搬到 SectionKnowledgePairs，內容不變所以版本不遞增"""
+        has_legacy = (
+            db.session.query(StudentAIConversations.knowledge.isnot(None))
+            .filter_by(id=student_conversation.id)
+            .scalar()
+        )
+        if not has_legacy:
+            return
+        legacy = (
+            StudentAIConversations.query.options(undefer(StudentAIConversations.knowledge))
+            .filter_by(id=student_conversation.id)
+            .with_for_update()
+            .populate_existing()
+            .one()
+        )
+        # 其他 worker 已經搬完
+        if legacy.knowledge is None:
+            db.session.rollback()
+            return
+        db.session.add_all(
+            SectionKnowledgePairs(conversation_id=legacy.id, question=pair["q"], answer=pair["a"])
+            for pair in json.loads(legacy.knowledge)
+        )
+        legacy.knowledge = None
+        db.session.commit()
+
+    def get(self, student_conversation):
+        return self._load(student_conversation).pairs
+
+    def search(self, student_conversation, query, top_k=5, query_embedding=None):
+        """找出與學生問題最相關的 top_k 組教師問答；可傳入已計算好的問題向量"""
+        import faiss
+
+        entry = self._load(student_conversation)
+        if not entry.pairs:
+            return []
+
+        if query_embedding is None:
+            query_embedding = embedding_service.encode([query])
+        query_embedding = np.array(query_embedding, dtype=np.float32).reshape(1, -1)
+        faiss.normalize_L2(query_embedding)
+        return entry.search(query_embedding, top_k)
+
+    def add_exchange(self, course_id, course_section, question, answer):
+        """教師新增一組問答時，加入已部署單元的快照與索引；只新增一筆，不重寫整份快照"""
+        try:
+            student_conversation = StudentAIConversations.query.filter_by(
+                course_id=course_id, course_section=course_section
+            ).first()
+            # 尚未部署，或舊部署尚未建立快照（會在第一次讀取時完整編譯）
+            if student_conversation is None or student_conversation.deployed_at is None:
+                return
+
+            # 先遞增版本取得單元列的鎖，與重新部署互斥
+            version = StudentAIConversations.knowledge_version
+            StudentAIConversations.query.filter_by(id=student_conversation.id).update(
+                {version: version + 1}, synchronize_session=False
+            )
+            db.session.add(
+                SectionKnowledgePairs(
+                    conversation_id=student_conversation.id, question=question, answer=answer
+                )
+            )
+            db.session.commit()
+
+            self._load(student_conversation)
+        except Exception as e:
+            db.session.rollback()
+            print(f"更新單元知識時發生錯誤: {e}")
+
+
+section_knowledge = SectionKnowledge()
@@ -0,0 +1,128 @@
+import threading
+import time
+from collections import OrderedDict
+from itertools import count
+
+import numpy as np
+
+from app.services.embedding import embedding_service
+from app.services.metrics import metrics
+
+
+class _CachedAnswer:
+    __slots__ = ("question", "answer", "embedding", "created_at", "latency")
+
+    def __init__(self, question, answer, embedding, latency):
+        self.question = question
+        self.answer = answer
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+        self.latency = latency
+
+
+class _SectionCache:
+    def __init__(self, version):
+        self.version = version
+        self.entries = OrderedDict()  # entry id -> _CachedAnswer
+
+
+class SemanticCache:
+    """以 (course_id, course_section) 分區的語意快取：相似度超過門檻的問題直接回傳先前的答案"""
+
+    def __init__(self, threshold=0.92, ttl=3600, max_entries=256):
+        self.enabled = True
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+        self._sections = {}
+        self._ids = count()
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.enabled = app.config.get("SEMANTIC_CACHE_ENABLED", self.enabled)
+        self.threshold = app.config.get("SEMANTIC_CACHE_THRESHOLD", self.threshold)
+        self.ttl = app.config.get("SEMANTIC_CACHE_TTL", self.ttl)
+        self.max_entries = app.config.get("SEMANTIC_CACHE_MAX_ENTRIES", self.max_entries)
+        metrics.register("semantic_cache", self.stats)
+
+    @staticmethod
+    def embed(question):
+        embedding = np.asarray(embedding_service.encode([question]), dtype=np.float32)[0]
+        norm = np.linalg.norm(embedding)
+        return embedding / norm if norm else embedding
+
+    def _section(self, key, version):
+        """取得分區；知識快照版本不同（重新部署或教師新增問答）時整個分區作廢"""
+        section = self._sections.get(key)
+        if section is None or section.version != version:
+            section = _SectionCache(version)
+            self._sections[key] = section
+        return section
+
+    def _expire(self, section):
+        deadline = time.monotonic() - self.ttl
+        for entry_id in [i for i, e in section.entries.items() if e.created_at < deadline]:
+            del section.entries[entry_id]
+
+    def lookup(self, key, version, embedding):
+        """命中時回傳快取的答案，否則回傳 None"""
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            section = self._section(key, version)
+            self._expire(section)
+
+            best_id, best_score = None, -1.0
+            if section.entries:
+                ids = list(section.entries.keys())
+                matrix = np.stack([section.entries[i].embedding for i in ids])
+                scores = matrix @ embedding
+                best = int(np.argmax(scores))
+                best_id, best_score = ids[best], float(scores[best])
+
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            section.entries.move_to_end(best_id)
+            entry = section.entries[best_id]
+            self.hits += 1
+            self.latency_saved += entry.latency
+
+        metrics.observe("semantic_cache.hit_similarity", best_score)
+        return entry.answer
+
+    def store(self, key, version, question, embedding, answer, latency):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            section = self._section(key, version)
+            section.entries[next(self._ids)] = _CachedAnswer(
+                question, answer, embedding, latency
+            )
+            while len(section.entries) > self.max_entries:
+                section.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._sections.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "sections": len(self._sections),
+                "entries": sum(len(s.entries) for s in self._sections.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved_seconds": self.latency_saved,
+            }
+
+
+semantic_cache = SemanticCache()
@@ -0,0 +1,99 @@
+import json
+from datetime import datetime
+
+import numpy as np
+from flask import current_app
+
+from app.models import TeacherAIFaisses, TeacherFiles, VectorStorageReports, db
+from app.services.background import BackgroundExecutor
+from app.services.index_artifacts import index_artifacts
+from app.services.metrics import metrics
+from app.services.vector_index import index_factory
+
+
+class StorageReportService:
+    """在背景比較課程可用的向量儲存方式；每個檔案以實際會建立的索引類型與儲存方式計算，老師輪詢結果"""
+
+    def __init__(self):
+        self.executor = BackgroundExecutor("storage-report", max_workers=1)
+        self.max_vectors = 20_000
+        self.max_top_k = 100
+        self.queries = 200
+
+    def init_app(self, app):
+        self.max_vectors = app.config.get("STORAGE_REPORT_MAX_VECTORS", self.max_vectors)
+
+    def enqueue(self, course_id, top_k=10):
+        report = VectorStorageReports(
+            course_id=course_id, top_k=max(1, min(top_k, self.max_top_k)), status="pending"
+        )
+        db.session.add(report)
+        db.session.commit()
+
+        self.executor.submit(current_app._get_current_object(), self._run, report.id)
+        metrics.incr("storage_report.enqueued")
+        return report
+
+    @staticmethod
+    def latest(course_id):
+        return (
+            VectorStorageReports.query.filter_by(course_id=course_id)
+            .order_by(VectorStorageReports.id.desc())
+            .first()
+        )
+
+    def sample_groups(self, course_id):
+        """回傳 (各檔案索引的向量, 課程的索引數)；整份抽樣，總向量數不超過 max_vectors"""
+        names = sorted(
+            {
+                faiss_file.artifact
+                for faiss_file in TeacherAIFaisses.query.join(
+                    TeacherFiles, TeacherFiles.id == TeacherAIFaisses.file_id
+                ).filter(TeacherFiles.course_id == course_id)
+                if faiss_file.artifact and index_artifacts.exists(faiss_file.artifact)
+            }
+        )
+        # 向量以 mmap 開啟，沒有抽中的檔案不會被讀取
+        vectors = [index_artifacts.load_vectors(name) for name in names]
+        order = np.random.default_rng(0).permutation(len(vectors))
+
+        groups = []
+        budget = self.max_vectors
+        for i in order:
+            if len(vectors[i]) <= budget:
+                groups.append(np.asarray(vectors[i], dtype=np.float32))
+                budget -= len(vectors[i])
+        if not groups and vectors:
+            # 每個檔案都超過上限時只取最小的一個
+            groups.append(np.asarray(min(vectors, key=len), dtype=np.float32))
+        return groups, len(vectors)
+
+    def _run(self, report_id):
+        report = VectorStorageReports.query.get(report_id)
+        if report is None:
+            return
+
+        report.status = "running"
+        db.session.commit()
+
+        try:
+            with metrics.timer("storage_report.seconds"):
+                groups, indexes = self.sample_groups(report.course_id)
+                rows = index_factory.storage_report(
+                    groups, queries=self.queries, top_k=report.top_k
+                )
+            report.report = json.dumps(
+                {"indexes": indexes, "indexes_sampled": len(groups), "storages": rows}
+            )
+            report.status = "done"
+        except Exception as e:
+            db.session.rollback()
+            report.status = "failed"
+            report.error = str(e)[:1000]
+            metrics.incr("storage_report.failed")
+        finally:
+            report.finished_at = datetime.now()
+            db.session.commit()
+
+
+storage_reports = StorageReportService()
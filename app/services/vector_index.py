@@ -0,0 +1,424 @@
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+FLAT = "flat"
+IVF_FLAT = "ivf_flat"
+HNSW = "hnsw"
+IVF_PQ = "ivf_pq"
+INDEX_TYPES = (FLAT, IVF_FLAT, HNSW, IVF_PQ)
+
+# 向量的儲存方式：原始 float32、純量量化 (fp16 / 8-bit) 或乘積量化
+FLOAT32 = "float32"
+FP16 = "fp16"
+SQ8 = "sq8"
+PQ = "pq"
+STORAGE_TYPES = (FLOAT32, FP16, SQ8, PQ)
+
+# 8-bit 乘積量化每個子空間有 256 個中心，訓練向量至少要這麼多
+PQ_MIN_TRAIN = 256
+
+
+def normalize(embeddings):
+    """L2 正規化，讓內積等於 cosine 相似度"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings.reshape(1, -1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def meta_path(index_path):
+    return os.path.splitext(index_path)[0] + ".json"
+
+
+def vectors_path(index_path):
+    """索引旁保存的 float32 原始向量 ({name}_vectors.npy)，供壓縮索引重新排序"""
+    base = os.path.splitext(index_path)[0]
+    if base.endswith("_index"):
+        base = base[: -len("_index")]
+    return f"{base}_vectors.npy"
+
+
+def read_index(index_path):
+    """以 mmap 讀取索引，不支援 mmap 的索引類型改為一般讀取"""
+    import faiss
+
+    try:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(index_path)
+
+
+def rerank(queries, candidate_ids, vectors, top_k):
+    """以原始向量重新計算候選的內積並取前 top_k，回傳與 index.search 相同格式的 (scores, ids)"""
+    scores = np.full((len(queries), top_k), -np.inf, dtype=np.float32)
+    ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+    for row, (query, candidates) in enumerate(zip(queries, candidate_ids)):
+        # 依 id 排序讀取，mmap 的向量檔較少跳頁
+        candidates = np.sort(candidates[candidates >= 0])
+        if not len(candidates):
+            continue
+        exact = normalize(vectors[candidates]) @ query
+        order = np.argsort(-exact)[:top_k]
+        scores[row, : len(order)] = exact[order]
+        ids[row, : len(order)] = candidates[order]
+    return scores, ids
+
+
+class RerankedIndex:
+    """壓縮索引先取 top_k × factor 個候選，再以 mmap 的 float32 原始向量精確排序；其餘屬性轉給原索引"""
+
+    def __init__(self, index, vectors, factor):
+        self.index = index
+        self.vectors = vectors
+        self.factor = factor
+
+    def __getattr__(self, name):
+        return getattr(self.index, name)
+
+    def search(self, queries, top_k):
+        _, candidate_ids = self.index.search(queries, min(top_k * self.factor, self.index.ntotal))
+        return rerank(queries, candidate_ids, self.vectors, top_k)
+
+
+class IndexFactory:
+    """依向量數量選擇 FAISS 索引類型（Flat / IVF-Flat / HNSW / IVF-PQ）與向量儲存方式，並保存訓練後的參數"""
+
+    def __init__(self):
+        self.index_type = "auto"
+        # auto 模式下各類型的向量數上限
+        self.flat_max = 10_000
+        self.hnsw_max = 200_000
+        self.ivf_flat_max = 2_000_000
+        self.hnsw_m = 32
+        self.ef_construction = 200
+        self.ef_search = 64
+        self.nprobe = 16
+        self.pq_m = 48
+        self.storage = FLOAT32
+        self.rerank_factor = 4
+        # 向量分批正規化後加入索引；訓練最多使用的向量數（至少每個群 64 個）
+        self.add_batch_size = 65536
+        self.max_train = 100_000
+
+    def init_app(self, app):
+        self.index_type = app.config.get("VECTOR_INDEX_TYPE", self.index_type)
+        self.storage = app.config.get("VECTOR_INDEX_STORAGE", self.storage)
+        self.rerank_factor = app.config.get("VECTOR_INDEX_RERANK_FACTOR", self.rerank_factor)
+        self.nprobe = app.config.get("VECTOR_INDEX_NPROBE", self.nprobe)
+        self.ef_search = app.config.get("VECTOR_INDEX_EF_SEARCH", self.ef_search)
+
+    def choose(self, ntotal):
+        if self.index_type != "auto":
+            return self.index_type
+        if ntotal <= self.flat_max:
+            return FLAT
+        if ntotal <= self.hnsw_max:
+            return HNSW
+        if ntotal <= self.ivf_flat_max:
+            return IVF_FLAT
+        return IVF_PQ
+
+    @staticmethod
+    def nlist_for(ntotal):
+        # 每個群至少約 39 個訓練向量，FAISS 才不會警告
+        return max(1, min(int(4 * math.sqrt(ntotal)), ntotal // 39))
+
+    def _pq_m_for(self, dimension):
+        m = min(self.pq_m, dimension)
+        while dimension % m:
+            m -= 1
+        return m
+
+    @staticmethod
+    def _sq_type(storage):
+        import faiss
+
+        if storage == FP16:
+            return faiss.ScalarQuantizer.QT_fp16
+        return faiss.ScalarQuantizer.QT_8bit
+
+    def flat_index(self, dimension, storage=FLOAT32):
+        """暴力搜尋的內積索引；fp16 不需要訓練，sq8 / pq 需要先 train"""
+        import faiss
+
+        if storage == FLOAT32:
+            return faiss.IndexFlatIP(dimension)
+        if storage == PQ:
+            return faiss.IndexPQ(
+                dimension, self._pq_m_for(dimension), 8, faiss.METRIC_INNER_PRODUCT
+            )
+        return faiss.IndexScalarQuantizer(
+            dimension, self._sq_type(storage), faiss.METRIC_INNER_PRODUCT
+        )
+
+    def _training_sample(self, embeddings, nlist=1):
+        ntotal = len(embeddings)
+        size = min(ntotal, max(self.max_train, 64 * nlist))
+        if size == ntotal:
+            return normalize(embeddings)
+        picked = np.sort(np.random.default_rng(0).choice(ntotal, size=size, replace=False))
+        return normalize(embeddings[picked])
+
+    def build(self, embeddings, index_type=None, storage=None):
+        """以正規化後的向量建立內積索引
+
+        embeddings 可以是 mmap 的陣列：訓練只使用抽樣，加入索引時分批正規化，不會複製整份向量
+        """
+        import faiss
+
+        # float32 的 mmap 不會被複製
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        ntotal, dimension = embeddings.shape
+        nlist = 1
+        index_type = index_type or self.choose(ntotal)
+        storage = storage or self.storage
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown vector index type: {index_type}")
+        if storage not in STORAGE_TYPES:
+            raise ValueError(f"Unknown vector storage: {storage}")
+        if storage == PQ and ntotal < PQ_MIN_TRAIN:
+            print(f"向量數 {ntotal} 不足以訓練乘積量化，改用 {SQ8}")
+            storage = SQ8
+
+        if index_type == FLAT:
+            index = self.flat_index(dimension, storage)
+        elif index_type == HNSW:
+            if storage == FLOAT32:
+                index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+            elif storage == PQ:
+                index = faiss.IndexHNSWPQ(
+                    dimension,
+                    self._pq_m_for(dimension),
+                    self.hnsw_m,
+                    8,
+                    faiss.METRIC_INNER_PRODUCT,
+                )
+            else:
+                index = faiss.IndexHNSWSQ(
+                    dimension, self._sq_type(storage), self.hnsw_m, faiss.METRIC_INNER_PRODUCT
+                )
+            index.hnsw.efConstruction = self.ef_construction
+            index.hnsw.efSearch = self.ef_search
+        else:
+            nlist = self.nlist_for(ntotal)
+            quantizer = faiss.IndexFlatIP(dimension)
+            if index_type == IVF_FLAT and storage == FLOAT32:
+                index = faiss.IndexIVFFlat(
+                    quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT
+                )
+            elif index_type == IVF_FLAT and storage != PQ:
+                index = faiss.IndexIVFScalarQuantizer(
+                    quantizer,
+                    dimension,
+                    nlist,
+                    self._sq_type(storage),
+                    faiss.METRIC_INNER_PRODUCT,
+                )
+            else:
+                index = faiss.IndexIVFPQ(
+                    quantizer,
+                    dimension,
+                    nlist,
+                    self._pq_m_for(dimension),
+                    8,
+                    faiss.METRIC_INNER_PRODUCT,
+                )
+            index.nprobe = min(self.nprobe, nlist)
+
+        if not index.is_trained:
+            index.train(self._training_sample(embeddings, nlist))
+        for start in range(0, ntotal, self.add_batch_size):
+            index.add(normalize(embeddings[start : start + self.add_batch_size]))
+        return index
+
+    @staticmethod
+    def describe(index):
+        """從索引本身取出類型與訓練後的參數"""
+        import faiss
+
+        meta = {
+            "metric": "ip" if index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+            "normalized": index.metric_type == faiss.METRIC_INNER_PRODUCT,
+            "dimension": index.d,
+            "ntotal": index.ntotal,
+            "storage": IndexFactory._storage_of(index),
+        }
+        if isinstance(index, faiss.IndexHNSW):
+            meta.update(
+                type=HNSW,
+                m=index.hnsw.nb_neighbors(1),
+                ef_construction=index.hnsw.efConstruction,
+                ef_search=index.hnsw.efSearch,
+            )
+            return meta
+
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            meta["type"] = FLAT
+            return meta
+
+        meta.update(nlist=ivf.nlist, nprobe=ivf.nprobe)
+        if isinstance(ivf, faiss.IndexIVFPQ):
+            meta.update(type=IVF_PQ, pq_m=ivf.pq.M, pq_nbits=ivf.pq.nbits)
+        else:
+            meta["type"] = IVF_FLAT
+        return meta
+
+    @staticmethod
+    def _storage_of(index):
+        import faiss
+
+        if isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        else:
+            try:
+                index = faiss.extract_index_ivf(index)
+            except RuntimeError:
+                pass
+
+        if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+            return PQ
+        sq = getattr(index, "sq", None)
+        if sq is not None:
+            return FP16 if sq.qtype == faiss.ScalarQuantizer.QT_fp16 else SQ8
+        return FLOAT32
+
+    @staticmethod
+    def apply_search_params(index, meta):
+        """依保存的參數設定查詢參數"""
+        import faiss
+
+        index_type = meta.get("type", FLAT)
+        if index_type == HNSW and "ef_search" in meta:
+            index.hnsw.efSearch = meta["ef_search"]
+        elif index_type in (IVF_FLAT, IVF_PQ) and "nprobe" in meta:
+            faiss.extract_index_ivf(index).nprobe = meta["nprobe"]
+
+    def save_meta(self, index_path, index):
+        meta = self.describe(index)
+        with open(meta_path(index_path), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        return meta
+
+    def load_meta(self, index_path, index):
+        """讀取索引參數；舊版沒有參數檔的索引是未正規化的 IndexFlatL2"""
+        path = meta_path(index_path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        else:
+            meta = {"type": FLAT, "metric": "l2", "normalized": False}
+        self.apply_search_params(index, meta)
+        return meta
+
+    def attach_rerank(self, index_path, index, meta):
+        """壓縮儲存的索引若旁邊有原始向量檔，搜尋時改用原始向量重新排序"""
+        if meta.get("storage", FLOAT32) == FLOAT32 or self.rerank_factor <= 1:
+            return index
+        path = vectors_path(index_path)
+        if not os.path.exists(path):
+            return index
+        # mmap 的向量在 page cache 中由各 worker 共用，只有候選會被讀入
+        vectors = np.load(path, mmap_mode="r")
+        if len(vectors) != index.ntotal:
+            return index
+        return RerankedIndex(index, vectors, self.rerank_factor)
+
+    @staticmethod
+    def search(index, query_embeddings, top_k):
+        """回傳 (scores, ids)；內積索引會先正規化查詢向量"""
+        import faiss
+
+        query_embeddings = np.ascontiguousarray(query_embeddings, dtype=np.float32)
+        if query_embeddings.ndim == 1:
+            query_embeddings = query_embeddings.reshape(1, -1)
+        if index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            query_embeddings = normalize(query_embeddings)
+        return index.search(query_embeddings, min(top_k, index.ntotal))
+
+    def storage_report(self, groups, queries=200, top_k=10, index_type=None, seed=0):
+        """以留出的向量為查詢，比較各儲存方式的索引大小、recall@k（含/不含重新排序）與查詢時間
+
+        groups 為各個索引的向量（例如課程中每個檔案一組）；每組依自己的向量數選擇索引類型，
+        與實際建立索引時相同（含向量太少時 pq 改用 sq8），結果為所有組的合計
+        """
+        import faiss
+
+        groups = [normalize(group) for group in groups if len(group) >= 2]
+        total = sum(len(group) for group in groups)
+        if not total:
+            return []
+
+        rng = np.random.default_rng(seed)
+        splits = []
+        for group in groups:
+            # 查詢數依各組向量數比例分配，每組至少一個、最多一成
+            count = max(1, min(round(queries * len(group) / total), len(group) // 10 or 1))
+            picked = rng.choice(len(group), size=count, replace=False)
+            mask = np.ones(len(group), dtype=bool)
+            mask[picked] = False
+            base, query_embeddings = group[mask], group[picked]
+            k = min(top_k, len(base))
+            exact = faiss.IndexFlatIP(base.shape[1])
+            exact.add(base)
+            _, truth = exact.search(query_embeddings, k)
+            splits.append((base, query_embeddings, k, truth))
+
+        report = []
+        for storage in STORAGE_TYPES:
+            row = {
+                "storage": storage,
+                "top_k": top_k,
+                "indexes": len(splits),
+                "vectors": 0,
+                "index_bytes": 0,
+                "index_types": {},
+                "built_as": {},
+            }
+            hits = reranked_hits = expected = 0
+            search_seconds = rerank_seconds = 0.0
+            query_count = 0
+            for base, query_embeddings, k, truth in splits:
+                index = self.build(base, index_type, storage)
+                meta = self.describe(index)
+                row["vectors"] += len(base)
+                row["index_bytes"] += int(faiss.serialize_index(index).nbytes)
+                row["index_types"][meta["type"]] = row["index_types"].get(meta["type"], 0) + 1
+                row["built_as"][meta["storage"]] = row["built_as"].get(meta["storage"], 0) + 1
+
+                start = time.perf_counter()
+                _, ids = index.search(query_embeddings, k)
+                search_seconds += time.perf_counter() - start
+
+                start = time.perf_counter()
+                _, reranked_ids = RerankedIndex(index, base, self.rerank_factor).search(
+                    query_embeddings, k
+                )
+                rerank_seconds += time.perf_counter() - start
+
+                for found, reranked, exact_ids in zip(ids, reranked_ids, truth):
+                    exact_ids = set(exact_ids)
+                    hits += len(set(found) & exact_ids)
+                    reranked_hits += len(set(reranked) & exact_ids)
+                expected += len(query_embeddings) * k
+                query_count += len(query_embeddings)
+
+            row.update(
+                bytes_per_vector=round(row["index_bytes"] / row["vectors"], 1),
+                recall=round(hits / expected, 4),
+                recall_reranked=round(reranked_hits / expected, 4),
+                query_ms=round(search_seconds * 1000 / query_count, 3),
+                query_ms_reranked=round(rerank_seconds * 1000 / query_count, 3),
+            )
+            report.append(row)
+        return report
+
+
+index_factory = IndexFactory()
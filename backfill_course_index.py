@@ -0,0 +1,21 @@
+def backfill():
+    """把所有課程中尚未加入課程索引的 PDF 排入佇列，並等待背景工作完成"""
+    # 在函式內匯入：PDF 提取的子行程以 spawn 重新匯入本檔時不會載入 app
+    from app import create_app
+    from app.models import Course
+    from app.services.course_index import course_index
+    from app.services.ingestion import ingestion
+
+    app = create_app("development")
+    # 舊版（依模型分目錄前）的課程索引已不再使用
+    course_index.remove_legacy_dirs()
+    with app.app_context():
+        for course in Course.query.all():
+            jobs = ingestion.backfill_course(course.id)
+            if jobs:
+                print(f"課程 {course.id}: 排入 {len(jobs)} 個檔案")
+    # 背景執行緒結束後程式才會離開
+
+
+if __name__ == "__main__":
+    backfill()
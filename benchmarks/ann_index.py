@@ -0,0 +1,93 @@
+"""比較各種 FAISS 索引類型對 Flat 的 recall@k 與單筆查詢延遲 (p50/p99)
+
+預設使用隨機產生的群聚向量；指定 --embeddings 可改用實際的嵌入向量 (.npy)。
+
+用法:
+    python benchmarks/ann_index.py --vectors 100000 --queries 500 --k 10
+    python benchmarks/ann_index.py --embeddings saved.npy --types flat,hnsw
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.vector_index import INDEX_TYPES, FLAT, IndexFactory  # noqa: E402
+
+
+def synthetic_embeddings(n, dimension, clusters, seed):
+    # 模擬句子嵌入：向量集中在少數主題附近
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=n)
+    noise = rng.standard_normal((n, dimension)).astype(np.float32) * 0.5
+    return centers[labels] + noise
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def run(factory, index_type, data, queries, k, truth):
+    start = time.perf_counter()
+    index = factory.build(data, index_type)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = factory.search(index, query, k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0]) & set(truth[i]))
+
+    meta = factory.describe(index)
+    params = {key: meta[key] for key in ("nlist", "nprobe", "m", "ef_search", "pq_m") if key in meta}
+    print(
+        f"{index_type:9s} build={build_seconds:7.2f}s "
+        f"recall@{k}={hits / (len(queries) * k):.3f} "
+        f"p50={percentile(latencies, 50):.3f}ms p99={percentile(latencies, 99):.3f}ms "
+        f"params={params}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default=",".join(INDEX_TYPES))
+    parser.add_argument("--embeddings", help="以 .npy 檔提供的嵌入向量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        data = np.load(args.embeddings).astype(np.float32)
+    else:
+        data = synthetic_embeddings(args.vectors, args.dimension, args.clusters, args.seed)
+
+    rng = np.random.default_rng(args.seed + 1)
+    queries = data[rng.choice(len(data), size=args.queries, replace=False)]
+    queries = queries + rng.standard_normal(queries.shape).astype(np.float32) * 0.1
+
+    factory = IndexFactory()
+    print(
+        f"vectors={len(data)} dimension={data.shape[1]} queries={len(queries)} "
+        f"auto={factory.choose(len(data))}"
+    )
+
+    # 以 Flat 的精確結果作為 ground truth
+    exact = factory.build(data, FLAT)
+    _, truth = factory.search(exact, queries, args.k)
+
+    for index_type in args.types.split(","):
+        run(factory, index_type.strip(), data, queries, args.k, truth)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""對實際的 /chat 端點做同時請求壓測，比較不同的 worker 設定
+
+LLM 以本機的假 OpenAI 相容伺服器取代，每個請求固定延遲後回傳，量到的是伺服器本身能同時處理多少個等待 LLM 的請求。
+
+用法:
+    # 1. 啟動假的 LLM 伺服器
+    python benchmarks/chat_endpoint.py fake-llm --port 9100 --delay 1.0
+
+    # 2. 讓 app 連到假的伺服器，以 gunicorn.conf.py 分別用不同的 worker 啟動，例如
+    OPENAI_API_KEY=sk-fake OPENAI_BASE_URL=http://127.0.0.1:9100/v1 \\
+        GUNICORN_WORKERS=1 GUNICORN_BIND=127.0.0.1:8000 gunicorn run:app
+    OPENAI_API_KEY=sk-fake OPENAI_BASE_URL=http://127.0.0.1:9100/v1 \\
+        GUNICORN_WORKERS=1 GUNICORN_WORKER_CLASS=eventlet GUNICORN_BIND=127.0.0.1:8000 gunicorn run:app
+
+    # 3. 對端點送出同時請求（每個請求使用新的對話）
+    python benchmarks/chat_endpoint.py load --url http://127.0.0.1:8000 \\
+        --username neokent --password securepassword1 --course-id 1 --section-id 1 \\
+        --requests 500 --concurrency 200
+"""
+import argparse
+import asyncio
+import time
+import uuid
+from collections import Counter
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+
+def make_fake_llm_app(delay):
+    async def completions(request):
+        body = await request.json()
+        await asyncio.sleep(delay)
+        return web.json_response(
+            {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "ok"},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2},
+            }
+        )
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", completions)
+    return app
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+async def login(session, url, username, password):
+    async with session.post(
+        f"{url}/login", json={"username": username, "password": password}
+    ) as response:
+        response.raise_for_status()
+        return (await response.json())["access_token"]
+
+
+async def run_load(args):
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.concurrency)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        token = await login(session, args.url, args.username, args.password)
+        headers = {"Authorization": f"Bearer {token}"}
+        semaphore = asyncio.Semaphore(args.concurrency)
+        latencies = []
+        statuses = Counter()
+
+        async def one():
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with session.post(
+                        f"{args.url}/chat/{uuid.uuid4()}",
+                        json={
+                            "user_input": "hi",
+                            "course_id": args.course_id,
+                            "course_section_id": args.section_id,
+                        },
+                        headers=headers,
+                    ) as response:
+                        await response.read()
+                        statuses[response.status] += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.requests)))
+        seconds = time.perf_counter() - start
+
+    print(
+        f"requests={args.requests} concurrency={args.concurrency} wall={seconds:.2f}s "
+        f"throughput={args.requests / seconds:.1f} req/s "
+        f"p50={percentile(latencies, 50):.0f}ms p99={percentile(latencies, 99):.0f}ms "
+        f"status={dict(statuses)}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fake = commands.add_parser("fake-llm", help="啟動假的 OpenAI 相容伺服器")
+    fake.add_argument("--port", type=int, default=9100)
+    fake.add_argument("--delay", type=float, default=1.0, help="每次回應的延遲秒數")
+
+    load = commands.add_parser("load", help="對 /chat 端點送出同時請求")
+    load.add_argument("--url", default="http://127.0.0.1:8000")
+    load.add_argument("--username", required=True)
+    load.add_argument("--password", required=True)
+    load.add_argument("--course-id", type=int, required=True)
+    load.add_argument("--section-id", type=int, required=True)
+    load.add_argument("--requests", type=int, default=500)
+    load.add_argument("--concurrency", type=int, default=200)
+    load.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    if args.command == "fake-llm":
+        web.run_app(make_fake_llm_app(args.delay), host="127.0.0.1", port=args.port, backlog=4096)
+    else:
+        asyncio.run(run_load(args))
+
+
+if __name__ == "__main__":
+    main()
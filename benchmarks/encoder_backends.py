@@ -0,0 +1,106 @@
+"""比較嵌入模型在 torch / onnx / onnx-int8 後端的吞吐量、單筆延遲與向量一致性（對 torch 的 cosine 相似度）
+
+預設使用內建的中英文句子；指定 --texts 可改用實際的段落（每行一段）。
+
+用法:
+    python benchmarks/encoder_backends.py --batch-size 64 --queries 200
+    python benchmarks/encoder_backends.py --texts chunks.txt --backends torch,onnx-int8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.encoder_backends import BACKENDS, TORCH, load_encoder  # noqa: E402
+
+SAMPLE_TEXTS = [
+    "什麼是二元搜尋樹？請舉例說明插入與刪除的過程。",
+    "物件導向程式設計的三大特性是封裝、繼承與多型。",
+    "請解釋 TCP 三次握手的流程以及為什麼需要三次。",
+    "Explain the difference between a process and a thread.",
+    "A hash table provides average O(1) lookup by mapping keys to buckets.",
+    "軟體工程中的單元測試可以在修改程式時及早發現錯誤。",
+    "Gradient descent updates parameters in the direction of the negative gradient.",
+    "資料庫正規化的目的是減少重複資料並避免更新異常。",
+]
+
+
+def load_texts(path, count):
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            texts = [line.strip() for line in f if line.strip()]
+    else:
+        texts = SAMPLE_TEXTS
+    # 重複到需要的數量，並加上編號避免完全相同的輸入
+    return [f"{texts[i % len(texts)]} ({i})" for i in range(count)]
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000
+
+
+def measure(model, texts, batch_size, queries):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # 暖機
+
+    start = time.perf_counter()
+    embeddings = model.encode(texts, batch_size=batch_size, normalize_embeddings=True)
+    throughput = len(texts) / (time.perf_counter() - start)
+
+    latencies = []
+    for text in texts[:queries]:
+        start = time.perf_counter()
+        model.encode([text])
+        latencies.append(time.perf_counter() - start)
+
+    return np.asarray(embeddings, dtype=np.float32), throughput, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="paraphrase-multilingual-MiniLM-L12-v2")
+    parser.add_argument("--backends", default=",".join(BACKENDS))
+    parser.add_argument("--texts", help="每行一段的文字檔")
+    parser.add_argument("--count", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--quantization", default="avx2")
+    parser.add_argument("--export-dir", default=os.path.join(tempfile.gettempdir(), "onnx-export"))
+    args = parser.parse_args()
+
+    texts = load_texts(args.texts, args.count)
+    backends = [b.strip() for b in args.backends.split(",")]
+    # torch 是比較一致性的基準，一定要先跑
+    if TORCH not in backends:
+        backends.insert(0, TORCH)
+    else:
+        backends.remove(TORCH)
+        backends.insert(0, TORCH)
+
+    baseline = None
+    for backend in backends:
+        start = time.perf_counter()
+        model = load_encoder(args.model, backend, args.export_dir, args.quantization)
+        load_seconds = time.perf_counter() - start
+
+        embeddings, throughput, latencies = measure(
+            model, texts, args.batch_size, args.queries
+        )
+        if baseline is None:
+            baseline = embeddings
+        cosine = np.sum(embeddings * baseline, axis=1)
+
+        print(
+            f"{backend:10s} load={load_seconds:6.2f}s "
+            f"throughput={throughput:8.1f} texts/s "
+            f"p50={percentile(latencies, 50):7.2f}ms p99={percentile(latencies, 99):7.2f}ms "
+            f"cosine_vs_torch mean={cosine.mean():.4f} min={cosine.min():.4f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
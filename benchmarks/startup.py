@@ -0,0 +1,55 @@
+"""比較 create_app() 在延遲載入與預先載入 AI 模型時的冷啟動時間
+
+用法:
+    python benchmarks/startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 每次在新的行程中量測，確保是冷啟動
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+from app import create_app
+create_app("testing")
+elapsed = time.perf_counter() - start
+heavy = [m for m in ("torch", "sentence_transformers", "faiss", "langchain") if m in sys.modules]
+print(json.dumps({"seconds": elapsed, "heavy_modules": heavy}))
+"""
+
+
+def run_once(preload):
+    env = dict(os.environ)
+    env["AI_PRELOAD"] = "true" if preload else "false"
+    # Config 需要以下設定才能載入，testing 環境實際使用 sqlite
+    env.setdefault("DB_PORT", "3306")
+    env.setdefault("OPENAI_API_KEY", "sk-benchmark")
+    output = subprocess.check_output(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env, stderr=subprocess.DEVNULL
+    )
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for label, preload in (("lazy (default)", False), ("eager (AI_PRELOAD)", True)):
+        results = [run_once(preload) for _ in range(args.runs)]
+        seconds = [r["seconds"] for r in results]
+        print(
+            f"{label:20s} median={statistics.median(seconds):.3f}s "
+            f"min={min(seconds):.3f}s max={max(seconds):.3f}s "
+            f"heavy_modules={results[-1]['heavy_modules']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""比較向量儲存方式 (float32 / fp16 / sq8 / pq) 的索引大小、recall@k（含/不含以原始向量重新排序）與查詢時間
+
+預設使用隨機產生的群聚向量；指定 --embeddings 可改用實際的嵌入向量 (.npy，例如 saved_data 中的 *_vectors.npy)。
+
+用法:
+    python benchmarks/vector_storage.py --vectors 50000 --k 10
+    python benchmarks/vector_storage.py --embeddings saved.npy --type flat --rerank-factor 8
+    python benchmarks/vector_storage.py --vectors 50000 --group-size 2000  # 模擬每個檔案各一個索引
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.vector_index import IndexFactory  # noqa: E402
+from benchmarks.ann_index import synthetic_embeddings  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--vectors", type=int, default=50_000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--type", help="索引類型，預設依各組向量數自動選擇")
+    parser.add_argument("--group-size", type=int, help="切成多個索引，每個索引的向量數")
+    parser.add_argument("--rerank-factor", type=int, default=4)
+    parser.add_argument("--embeddings", help="以 .npy 檔提供的嵌入向量")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.embeddings:
+        data = np.load(args.embeddings).astype(np.float32)
+    else:
+        data = synthetic_embeddings(args.vectors, args.dimension, args.clusters, args.seed)
+
+    factory = IndexFactory()
+    factory.rerank_factor = args.rerank_factor
+    group_size = args.group_size or len(data)
+    groups = [data[start : start + group_size] for start in range(0, len(data), group_size)]
+    report = factory.storage_report(
+        groups, queries=args.queries, top_k=args.k, index_type=args.type, seed=args.seed
+    )
+    if not report:
+        print("向量數不足，無法產生報告")
+        return
+
+    print(
+        f"vectors={report[0]['vectors']} dimension={data.shape[1]} "
+        f"indexes={report[0]['indexes']} types={report[0]['index_types']} "
+        f"rerank_factor={args.rerank_factor}"
+    )
+    for row in report:
+        print(
+            f"{row['storage']:8s} built_as={row['built_as']} "
+            f"size={row['index_bytes'] / 1024 / 1024:8.2f}MB "
+            f"bytes/vector={row['bytes_per_vector']:7.1f} "
+            f"recall@{row['top_k']}={row['recall']:.3f} "
+            f"reranked={row['recall_reranked']:.3f} "
+            f"query={row['query_ms']:.3f}ms reranked={row['query_ms_reranked']:.3f}ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+"""gunicorn 設定，`gunicorn run:app` 會自動讀取
+
+/chat 等端點大部分時間在等待 LLM 回應，每個 worker 需要能同時處理多個請求：
+預設使用 gthread，每個 worker 開 GUNICORN_THREADS 個執行緒。
+也可以設 GUNICORN_WORKER_CLASS=eventlet，但 eventlet 是協作式的，嵌入模型的 encode（CPU 運算）
+與課程索引的 fcntl.flock 都會卡住整個 worker 的事件迴圈，期間其他請求全部停住。
+"""
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", 2))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+threads = int(os.environ.get("GUNICORN_THREADS", 32))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 1000))
+# LLM 回應與串流可能超過預設的 30 秒
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 180))
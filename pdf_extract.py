@@ -0,0 +1,13 @@
+"""PDF 頁面提取的子行程入口
+
+放在 app 套件之外：PageExtractor 以 spawn 啟動子行程，子行程只需要匯入這個模組與 PyMuPDF，
+不會匯入 app（Flask、模型、嵌入服務等）。
+"""
+
+
+def extract_range(pdf_path, start, end):
+    """提取 [start, end) 頁，回傳 [(page_no, text), ...]，頁碼從 1 開始"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(pdf_path) as doc:
+        return [(i + 1, doc[i].get_text()) for i in range(start, min(end, doc.page_count))]
@@ -1,11 +1,13 @@
 import os
-from app import create_app
 
-app = create_app()
+# PDF 提取的子行程以 spawn 啟動，會以 __mp_main__ 重新執行本檔；子行程不需要建立 app
+if __name__ != "__mp_main__":
+    from app import create_app
 
-if not os.path.exists(app.config["UPLOAD_FOLDER"]):
-    os.makedirs(app.config["UPLOAD_FOLDER"])
+    app = create_app()
+
+    if not os.path.exists(app.config["UPLOAD_FOLDER"]):
+        os.makedirs(app.config["UPLOAD_FOLDER"])
 
 if __name__ == "__main__":
     app.run(debug=True)
-
@@ -0,0 +1,63 @@
+import pytest
+
+from app.services.llm_gateway import CircuitBreaker, LLMGateway
+
+
+class _Chunk:
+    def __init__(self, content):
+        self.content = content
+
+    def __add__(self, other):
+        return _Chunk(self.content + other.content)
+
+
+class _FakeClient:
+    def __init__(self, error=None):
+        self.error = error
+
+    def invoke(self, messages):
+        raise self.error
+
+    def stream(self, messages):
+        yield _Chunk("部分")
+        yield _Chunk("回應")
+
+
+def _half_open_gateway(monkeypatch, client):
+    gateway = LLMGateway()
+    gateway.breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    gateway.breaker.record_failure()
+    assert gateway.breaker.state == "open"
+    monkeypatch.setattr(gateway, "client", lambda model, max_tokens: client)
+    return gateway
+
+
+def test_non_retryable_error_releases_half_open_trial(monkeypatch):
+    gateway = _half_open_gateway(monkeypatch, _FakeClient(ValueError("bad request")))
+
+    with pytest.raises(ValueError):
+        gateway.invoke([])
+
+    assert gateway.breaker.state == "closed"
+    assert gateway.breaker.allow()
+
+
+def test_disconnected_stream_releases_half_open_trial(monkeypatch):
+    gateway = _half_open_gateway(monkeypatch, _FakeClient())
+
+    chunks = gateway.stream([])
+    assert next(chunks) == "部分"
+    # SSE 用戶端斷線
+    chunks.close()
+
+    assert gateway.breaker.state == "closed"
+    assert gateway.breaker.allow()
+
+
+def test_half_open_allows_single_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()